@@ -0,0 +1,229 @@
+"""
+Run the audio analysis in a separate process.
+
+Decoding and transforming audio competes with drawing for the interpreter
+lock when both run in the same process. `AnalysisWorker` moves the analysis
+of a WAV file to its own process, which follows the play position set by the
+drawing process and writes every spectrum to a `SpectrumRing` in shared
+memory. The drawing process copies the latest spectrum from there.
+"""
+
+import time
+import ctypes
+import multiprocessing
+import multiprocessing.sharedctypes
+import numpy
+
+import audioanalyze
+
+
+class SpectrumRing:
+    """
+    Ring buffer of spectra in shared memory. Every slot has a sequence
+    counter that is odd while the slot is written (a seqlock), so readers
+    can tell if they read a half written spectrum and try again.
+    
+    Attributes:
+    slots       Number of spectra kept
+    num_keys    Length of every spectrum
+    powers      `(slots, num_keys)` array of spectra
+    seqs        Sequence counter of every slot
+    times       Timestamp of every slot
+    """
+    
+    slots = 8
+    num_keys = 0
+    powers = None
+    seqs = None
+    times = None
+    
+    
+    def __init__(self, num_keys, slots=8):
+        self.slots = slots
+        self.num_keys = num_keys
+        self._powers = multiprocessing.sharedctypes.RawArray(
+            ctypes.c_double, slots*num_keys
+        )
+        self._seqs = multiprocessing.sharedctypes.RawArray(
+            ctypes.c_long, slots
+        )
+        self._times = multiprocessing.sharedctypes.RawArray(
+            ctypes.c_double, slots
+        )
+        self._count = multiprocessing.sharedctypes.RawValue(ctypes.c_long, 0)
+        self._views()
+    
+    
+    def write(self, powers, timestamp=0.0):
+        """
+        Write a spectrum to the next slot. Only one process may write.
+        """
+        count = self._count.value
+        slot = count%self.slots
+        self.seqs[slot] += 1 # odd: being written
+        self.powers[slot] = powers
+        self.times[slot] = timestamp
+        self.seqs[slot] += 1
+        self._count.value = count+1
+        return 0
+    
+    
+    def read(self):
+        """
+        Return a tuple `(powers, timestamp, count)` for the latest spectrum,
+        or None if nothing was written yet. `powers` is a copy in a buffer of
+        the reader, which the next call of `read()` overwrites. `count` is
+        the number of spectra written so far.
+        """
+        while True:
+            count = self._count.value
+            if not count:
+                return None
+            slot = (count-1)%self.slots
+            seq = self.seqs[slot]
+            if seq%2:
+                continue
+            # copy before checking the counter again; a view would be
+            # overwritten by the writer while it is being used
+            numpy.copyto(self._out, self.powers[slot])
+            timestamp = self.times[slot]
+            if self.seqs[slot] == seq:
+                return self._out, timestamp, count
+    
+    
+    def _views(self):
+        self.powers = numpy.frombuffer(self._powers, dtype=numpy.float64)\
+            .reshape(self.slots, self.num_keys)
+        self.seqs = numpy.frombuffer(self._seqs, dtype=ctypes.c_long)
+        self.times = numpy.frombuffer(self._times, dtype=numpy.float64)
+        self._out = numpy.zeros(self.num_keys, dtype=numpy.float64)
+    
+    
+    def __getstate__(self):
+        # the shared arrays are handed to the worker process, not the views
+        state = self.__dict__.copy()
+        for name in ('powers', 'seqs', 'times', '_out'):
+            state.pop(name, None)
+        return state
+    
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._views()
+
+
+class AnalysisWorker:
+    """
+    Analyze a WAV file in a separate process. Set the play position with
+    `set_position()` and get the spectrum at that position with
+    `latest_frame()`.
+    
+    Attributes:
+    wavefile    Path of the analyzed WAV file
+    frame_size  Number of samples analyzed per spectrum
+    fft_size    Transform length of the spectra
+    samplerate  Samplerate of the file
+    ring        `SpectrumRing` the spectra are written to
+    process     The worker process
+    """
+    
+    wavefile = None
+    frame_size = 0
+    fft_size = 0
+    samplerate = 0
+    ring = None
+    process = None
+    
+    
+    def __init__(self, wavefile, fps=30, frame_size=0, weighting=None,
+            normalize=True, slots=8):
+        """
+        Arguments:
+        wavefile    Path of a WAV file
+        fps         Frames per second; the worker checks the play position
+                    about four times per frame
+        frame_size  Number of samples per spectrum (default: `1/fps`
+                    seconds)
+        weighting   Frequency weighting (see `AudioAnalyze.analyze()`)
+        normalize   Wether to normalize the spectra in the worker
+        slots       Number of spectra kept in shared memory
+        """
+        analyzer = audioanalyze.AudioAnalyze(wavefile)
+        self.wavefile = wavefile
+        self.frame_size = frame_size or analyzer.frame_size(fps)
+        self.fft_size = analyzer.fft_backend.fast_size(self.frame_size)
+        self.samplerate = analyzer.data_samplerate
+        self.ring = SpectrumRing(self.fft_size//2+1, slots)
+        self._position = multiprocessing.sharedctypes.RawValue(
+            ctypes.c_long, 0
+        )
+        self._stop = multiprocessing.Event()
+        self.process = multiprocessing.Process(
+            target=_work,
+            args=(
+                wavefile, self.ring, self._position, self._stop,
+                self.frame_size, weighting, normalize, 0.25/fps
+            )
+        )
+        self.process.daemon = True
+    
+    
+    def start(self):
+        self.process.start()
+        return 0
+    
+    
+    def stop(self):
+        self._stop.set()
+        self.process.join()
+        return 0
+    
+    
+    def set_position(self, pos=0):
+        """
+        Set the play position in frames that the worker analyzes next.
+        """
+        self._position.value = pos
+        return 0
+    
+    
+    def latest_frame(self):
+        """
+        Return the latest spectrum as an `audioanalyze.AnalysisFrame` (with
+        empty `data`), or None if there is none yet. Load it into an
+        analyzer with `AudioAnalyze.load_frame()`. The spectrum is the ring's
+        read buffer, so it only stays the same until the next call.
+        """
+        latest = self.ring.read()
+        if latest is None:
+            return None
+        powers, timestamp, count = latest
+        return audioanalyze.AnalysisFrame(
+            numpy.zeros(0, dtype=numpy.float32), powers, self.samplerate,
+            self.fft_size, timestamp, count
+        )
+
+
+def _work(wavefile, ring, position, stop, frame_size, weighting, normalize,
+        interval):
+    """
+    Main loop of the worker process: analyze the frame at the play position
+    whenever it changes.
+    """
+    analyzer = audioanalyze.AudioAnalyze(wavefile)
+    last_pos = None
+    while not stop.is_set():
+        pos = position.value
+        if pos == last_pos or pos+frame_size > analyzer.data_nframes:
+            time.sleep(interval)
+            continue
+        analyzer.wave_setpos(pos)
+        analyzer.wave_read(frames=frame_size)
+        analyzer.analyze(weighting=weighting)
+        if normalize:
+            analyzer.normalize()
+        ring.write(
+            analyzer.freq_powers, pos/float(analyzer.data_samplerate)
+        )
+        last_pos = pos
+    return 0
@@ -2,12 +2,1474 @@
 Analyze WAV audio files.
 """
 
-import struct
+import io
 import math
-import wave
+import struct
+import collections
+import threading
 import numpy
 import scipy.signal
+import scipy.sparse
 import scipy.fftpack
+try:
+    import scipy.fft # SciPy 1.4 and newer
+    _scipy_fft = scipy.fft
+except ImportError:
+    _scipy_fft = None
+
+
+# PCM sample decoding
+
+def pcm_view(raw_data, sampwidth=2, nchannels=1, float_format=False):
+    """
+    Return a `(frames, nchannels)` view of some raw little-endian PCM data
+    without copying it. 24-bit data can't be viewed as a NumPy integer type;
+    it is returned as a `(frames, nchannels, 3)` array of bytes instead.
+    Trailing bytes that don't make up a whole frame are ignored.
+    
+    Arguments:
+    raw_data        Any object supporting the buffer interface (str, mmap, ..)
+                    or a NumPy array of bytes
+    sampwidth       Sample width in bytes (1, 2, 3 or 4)
+    nchannels       Number of interleaved channels
+    float_format    Wether 4 byte samples are IEEE floats instead of integers
+    """
+    if float_format and sampwidth == 4:
+        dtype = numpy.dtype('<f4')
+    elif sampwidth == 1:
+        dtype = numpy.dtype('u1') # 8-bit WAV is unsigned
+    elif sampwidth == 2:
+        dtype = numpy.dtype('<i2')
+    elif sampwidth == 3:
+        dtype = numpy.dtype('u1')
+    elif sampwidth == 4:
+        dtype = numpy.dtype('<i4')
+    else:
+        raise AudioAnalyzeError("Unsupported sample width")
+    frame_size = sampwidth*nchannels
+    if isinstance(raw_data, numpy.ndarray):
+        raw = raw_data.reshape(-1).view(numpy.uint8)
+    else:
+        raw = numpy.frombuffer(raw_data, dtype=numpy.uint8)
+    raw = raw[:len(raw)-len(raw)%frame_size]
+    if sampwidth == 3:
+        return raw.reshape(-1, nchannels, 3)
+    return raw.view(dtype).reshape(-1, nchannels)
+
+
+def pcm_to_float(samples, downmix=False, out=None):
+    """
+    Convert a view as returned by `pcm_view()` to a float32 array of values
+    between -1 and 1. Only the first channel is used, unless `downmix` is
+    set, in which case all channels are averaged. The samples are copied
+    exactly once (24-bit samples need one additional integer buffer).
+    
+    Arguments:
+    samples     Array as returned by `pcm_view()`
+    downmix     Average all channels instead of using the first one only
+    out         Preallocated float32 array to write to (optional)
+    """
+    if samples.ndim == 3: # 24-bit: shift bytes into the top of an int32
+        wide = numpy.zeros(samples.shape[:2]+(4,), dtype=numpy.uint8)
+        wide[..., 1:] = samples
+        samples = wide.view('<i4')[..., 0]
+        scale = 1.0/2**31
+        offset = 0
+    elif samples.dtype.kind == 'f':
+        scale = 1.0
+        offset = 0
+    elif samples.dtype.kind == 'u':
+        scale = 1.0/2**(8*samples.dtype.itemsize-1)
+        offset = 2**(8*samples.dtype.itemsize-1)
+    else:
+        scale = 1.0/2**(8*samples.dtype.itemsize-1)
+        offset = 0
+    if out is None:
+        out = numpy.empty(len(samples), dtype=numpy.float32)
+    if downmix and samples.shape[1] > 1:
+        numpy.mean(samples, axis=1, dtype=numpy.float32, out=out)
+    else:
+        out[...] = samples[:, 0]
+    if offset:
+        out -= offset
+    if scale != 1.0:
+        out *= scale
+    return out
+
+
+# WAV files
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def wave_header(fileobj):
+    """
+    Parse the RIFF chunk table of a WAV file once and return a dictionary
+    with the keys `nchannels`, `sampwidth`, `framerate`, `float_format`,
+    `data_offset` (byte position of the samples in the file) and
+    `data_size` (length of the samples in bytes). Besides plain RIFF files,
+    RF64/BW64 files (larger than 4 GB) and WAVE_FORMAT_EXTENSIBLE formats
+    are understood.
+    
+    Arguments:
+    fileobj     A file object opened in binary mode
+    """
+    fileobj.seek(0, 2)
+    file_size = fileobj.tell()
+    fileobj.seek(0)
+    riff = fileobj.read(12)
+    if len(riff) < 12 or not riff[0:4] in (b'RIFF', b'RF64', b'BW64') \
+            or riff[8:12] != b'WAVE':
+        raise AudioAnalyzeError("Not a WAV file")
+    header = {}
+    ds64_data_size = None
+    while True:
+        chunk = fileobj.read(8)
+        if len(chunk) < 8:
+            break
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+        if chunk_id == b'ds64':
+            # 64-bit sizes of RF64 files; the 32-bit fields are 0xFFFFFFFF
+            ds64 = fileobj.read(chunk_size)
+            no, ds64_data_size = struct.unpack('<QQ', ds64[:16])
+            fileobj.seek(chunk_size%2, 1)
+        elif chunk_id == b'fmt ':
+            fmt = fileobj.read(chunk_size)
+            format_tag, header['nchannels'], header['framerate'], no, no, \
+            bits = struct.unpack('<HHIIHH', fmt[:16])
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 40:
+                # the actual format is the start of the sub format GUID
+                format_tag = struct.unpack('<H', fmt[24:26])[0]
+            if not format_tag in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT) \
+                    or not bits in (8, 16, 24, 32):
+                raise AudioAnalyzeError("Unsupported WAV file")
+            header['sampwidth'] = bits//8
+            header['float_format'] = format_tag == WAVE_FORMAT_IEEE_FLOAT
+            fileobj.seek(chunk_size%2, 1) # chunks are padded to even sizes
+        elif chunk_id == b'data':
+            if chunk_size == 0xFFFFFFFF and ds64_data_size is not None:
+                chunk_size = ds64_data_size
+            header['data_offset'] = fileobj.tell()
+            # size may be bogus for files that were written as a stream
+            header['data_size'] = min(chunk_size, file_size-fileobj.tell())
+            fileobj.seek(chunk_size+chunk_size%2, 1)
+        else:
+            fileobj.seek(chunk_size+chunk_size%2, 1)
+    if not 'sampwidth' in header or not 'data_offset' in header:
+        raise AudioAnalyzeError("WAV file is missing fmt or data chunk")
+    return header
+
+
+class WaveStream:
+    """
+    Read a WAV file (any format `wave_header()` understands) in chunks, so
+    that memory use doesn't depend on the file size.
+    
+    Attributes:
+    nchannels, sampwidth, framerate, nframes, float_format
+                Wave information
+    block_size  Number of frames in every block `blocks()` yields
+    downmix     Average all channels instead of using only the first one
+    """
+    
+    nchannels = 0
+    sampwidth = 0
+    framerate = 0
+    nframes = 0
+    float_format = False
+    block_size = 4096
+    downmix = False
+    
+    
+    def __init__(self, wavefile, block_size=4096, downmix=False):
+        """
+        Arguments:
+        wavefile    File path or seekable file like object in binary mode
+        block_size  See class attributes
+        downmix     See class attributes
+        """
+        if isinstance(wavefile, basestring):
+            self._file = io.open(wavefile, 'rb')
+        else:
+            self._file = wavefile
+        header = wave_header(self._file)
+        self.nchannels = header['nchannels']
+        self.sampwidth = header['sampwidth']
+        self.framerate = header['framerate']
+        self.float_format = header['float_format']
+        self._data_offset = header['data_offset']
+        self._frame_size = self.sampwidth*self.nchannels
+        self.nframes = header['data_size']//self._frame_size
+        self.block_size = block_size
+        self.downmix = downmix
+        self.setpos(0)
+    
+    
+    def read(self, frames):
+        """
+        Return the next `frames` frames (fewer at the end of the data) as a
+        new float32 array.
+        """
+        frames = max(min(frames, self.nframes-self._pos), 0)
+        raw_data = self._file.read(frames*self._frame_size)
+        self._pos += frames
+        return pcm_to_float(
+            pcm_view(
+                raw_data, self.sampwidth, self.nchannels, self.float_format
+            ),
+            self.downmix
+        )
+    
+    
+    def blocks(self):
+        """
+        Generator that yields the data from the current position on in
+        float32 blocks of exactly `block_size` frames. The last block is
+        padded with silence. The raw and the float buffers are allocated
+        once and reused, so copy a block to keep it.
+        """
+        raw_data = bytearray(self.block_size*self._frame_size)
+        raw_view = memoryview(raw_data)
+        block = numpy.zeros(self.block_size, dtype=numpy.float32)
+        while self._pos < self.nframes:
+            frames = min(self.block_size, self.nframes-self._pos)
+            length = self._file.readinto(raw_view[:frames*self._frame_size])
+            frames = length//self._frame_size
+            if not frames:
+                break
+            self._pos += frames
+            samples = pcm_view(
+                raw_data, self.sampwidth, self.nchannels, self.float_format
+            )[:frames]
+            pcm_to_float(samples, self.downmix, block[:frames])
+            block[frames:] = 0
+            yield block
+    
+    
+    def setpos(self, pos=0):
+        """
+        Move to the given frame.
+        """
+        if pos < 0 or pos > self.nframes:
+            raise AudioAnalyzeError("Time is beyond end of data")
+        self._file.seek(self._data_offset+pos*self._frame_size)
+        self._pos = pos
+        return 0
+    
+    
+    def getpos(self):
+        """
+        Return the current position in frames.
+        """
+        return self._pos
+    
+    
+    def seek(self, time=0.0):
+        """
+        Move to the given time in seconds.
+        """
+        return self.setpos(int(time*self.framerate))
+    
+    
+    def tell(self):
+        """
+        Return the current position in seconds.
+        """
+        return self._pos/float(self.framerate)
+    
+    
+    def duration(self):
+        """
+        Return the length of the data in seconds.
+        """
+        return self.nframes/float(self.framerate)
+    
+    
+    def close(self):
+        self._file.close()
+        return 0
+
+
+# Memory-mapped WAV files
+
+
+class WaveMap:
+    """
+    A WAV file whose samples are memory-mapped as a NumPy array. Seeking is
+    free, and every window of frames is a view into the file without any
+    reads or copies.
+    
+    Attributes:
+    samples     Array of shape `(nframes, nchannels)` (see `pcm_view()`)
+    nchannels, sampwidth, framerate, nframes, float_format
+                Wave information
+    """
+    
+    samples = None
+    nchannels = 0
+    sampwidth = 0
+    framerate = 0
+    nframes = 0
+    float_format = False
+    
+    
+    def __init__(self, path):
+        with open(path, 'rb') as fileobj:
+            header = wave_header(fileobj)
+        self.nchannels = header['nchannels']
+        self.sampwidth = header['sampwidth']
+        self.framerate = header['framerate']
+        self.float_format = header['float_format']
+        if header['data_size']:
+            raw = numpy.memmap(
+                path, dtype=numpy.uint8, mode='r',
+                offset=header['data_offset'], shape=(header['data_size'],)
+            )
+        else:
+            raw = numpy.zeros(0, dtype=numpy.uint8) # can't map empty ranges
+        self.samples = pcm_view(
+            raw, self.sampwidth, self.nchannels, self.float_format
+        )
+        self.nframes = len(self.samples)
+    
+    
+    def window(self, time=0.0, duration=0.0, start=None, frames=None):
+        """
+        Return a view of the frames in the given window. The window is
+        clipped to the available data.
+        
+        Arguments:
+        time        Start of the window in seconds...
+        duration    and its length in seconds, or
+        start       start frame...
+        frames      and number of frames
+        """
+        if start is None:
+            start = int(time*self.framerate)
+        if frames is None:
+            frames = int(duration*self.framerate)
+        return self.samples[max(start, 0):max(start+frames, 0)]
+    
+    
+    def close(self):
+        """
+        Release the mapping. Views that were handed out stay valid.
+        """
+        self.samples = None
+        return 0
+
+
+# Frequency bin aggregation
+
+class BinLayout:
+    """
+    Precalculated key ranges of a list of frequency bins for a given FFT size
+    and samplerate. A whole spectrum is aggregated into all bins at once with
+    `aggregate()`. The key ranges are the same that
+    `AudioAnalyze.freq_range_power()` uses.
+    
+    Attributes:
+    bins        Array of shape `(num, 2)` with the bins' frequency ranges
+    min_keys    First key of each bin
+    max_keys    Key after the last key of each bin
+    num_keys    Length of the spectra this layout is for
+    """
+    
+    bins = None
+    min_keys = None
+    max_keys = None
+    num_keys = 0
+    
+    
+    def __init__(self, bins=(), fft_size=0, samplerate=0, num_keys=None):
+        """
+        Arguments:
+        bins        List of `(min_freq, max_freq)` tuples (see
+                    `AudioAnalyze.linear_bins()`)
+        fft_size    Length of the transform the spectra come from
+        samplerate  Samplerate of the analyzed data
+        num_keys    Length of the spectra, `fft_size/2+1` by default
+        """
+        if num_keys is None:
+            num_keys = fft_size//2+1
+        self.num_keys = num_keys
+        self.bins = numpy.array(bins, dtype=numpy.float64).reshape(-1, 2)
+        if len(self.bins):
+            min_keys = self._keys(self.bins[:, 0], fft_size, samplerate)
+            max_keys = self._keys(self.bins[:, 1], fft_size, samplerate)
+        else:
+            min_keys = max_keys = numpy.zeros(0, dtype=numpy.intp)
+        # unknown or zero keys default to the whole range, DC offset excluded
+        min_keys[min_keys <= 0] = 1
+        max_keys[max_keys <= 0] = num_keys-1
+        self._set_keys(min_keys, max_keys)
+    
+    
+    @classmethod
+    def pool(cls, columns, num_keys, min_key=1, max_key=None):
+        """
+        Return a layout that splits the keys from `min_key` up to `max_key`
+        evenly into `columns` bins, e.g. one per pixel column of a surface.
+        If there are fewer keys than columns, keys are repeated.
+        """
+        if max_key is None:
+            max_key = num_keys-1
+        layout = cls(num_keys=num_keys)
+        edges = numpy.linspace(min_key, max_key, columns+1).astype(numpy.intp)
+        layout._set_keys(
+            edges[:-1], numpy.maximum(edges[1:], edges[:-1]+1)
+        )
+        layout.bins = None
+        return layout
+    
+    
+    def aggregate(self, powers, mode='mean', out=None):
+        """
+        Return the power of every bin as an array.
+        
+        Arguments:
+        powers  Spectrum of length `num_keys`
+        mode    'sum', 'mean' (like `AudioAnalyze.freq_range_power()`) or
+                'max'
+        out     Array to write the result to (optional)
+        """
+        if out is None:
+            out = numpy.empty(len(self.min_keys), dtype=numpy.float64)
+        if mode == 'max':
+            if len(self._indices):
+                maxima = numpy.maximum.reduceat(powers, self._indices)
+                out[...] = maxima[::2]
+            else:
+                out[...] = 0
+        else:
+            numpy.cumsum(powers, out=self._cumsum[1:])
+            numpy.subtract(
+                self._cumsum[self.max_keys], self._cumsum[self.min_keys],
+                out=out
+            )
+            if mode == 'mean':
+                out /= self._counts
+        out[self._empty] = 0
+        return out
+    
+    
+    def _keys(self, freqs, fft_size, samplerate):
+        if not fft_size or not samplerate:
+            return numpy.zeros(len(freqs), dtype=numpy.intp)
+        keys = (freqs/float(samplerate)*fft_size).astype(numpy.intp)
+        keys[(keys >= self.num_keys) | (keys < 0) | (freqs == 0)] = 0
+        return keys
+    
+    
+    def _set_keys(self, min_keys, max_keys):
+        self.min_keys = min_keys
+        self.max_keys = max_keys
+        self._empty = max_keys-min_keys <= 0
+        self._counts = (max_keys-min_keys+1).astype(numpy.float64)
+        self._cumsum = numpy.zeros(self.num_keys+1)
+        # reduceat reduces between consecutive indices, so interleave the
+        # ranges and only use every other result
+        indices = numpy.empty(2*len(min_keys), dtype=numpy.intp)
+        indices[0::2] = numpy.minimum(min_keys, self.num_keys-1)
+        indices[1::2] = numpy.minimum(max_keys, self.num_keys-1)
+        self._indices = indices
+
+
+# Frequency weighting
+
+def A_weighting_gain(freqs):
+    """
+    Return the (amplitude) gain of the A-weighting curve at the given
+    frequencies. Gain function according to Wikipedia.
+    """
+    f2 = numpy.asarray(freqs, dtype=numpy.float64)**2
+    return (
+        (12200**2 * f2**2)
+        / (
+            (f2 + 20.6**2) *
+            numpy.sqrt( (f2 + 107.7**2) * (f2 + 737.9**2) ) *
+            (f2 + 12200**2)
+        )
+    )
+
+
+def C_weighting_gain(freqs):
+    """
+    Return the gain of the C-weighting curve at the given frequencies.
+    Gain function according to Wikipedia.
+    """
+    f2 = numpy.asarray(freqs, dtype=numpy.float64)**2
+    return (12200**2 * f2) / ((f2 + 20.6**2) * (f2 + 12200**2))
+
+
+def K_weighting_gain(freqs):
+    """
+    Return the gain of the K-weighting curve of ITU-R BS.1770 at the given
+    frequencies: a high shelf followed by a high pass. The filter
+    coefficients are the ones given for 48 kHz; frequencies above 24 kHz
+    are clipped.
+    """
+    freqs = numpy.minimum(numpy.asarray(freqs, dtype=numpy.float64), 24000)
+    z = numpy.exp(-2j*math.pi*freqs/48000.0) # z**-1
+    # coefficients b2, b1, b0 and a2, a1, a0 (polyval wants highest first)
+    shelf_b = [1.19839281085285, -2.69169618940638, 1.53512485958697]
+    shelf_a = [0.73248077421585, -1.69065929318241, 1.0]
+    high_pass_b = [1.0, -2.0, 1.0]
+    high_pass_a = [0.99007225036621, -1.99004745483398, 1.0]
+    return numpy.abs(
+        numpy.polyval(shelf_b, z) / numpy.polyval(shelf_a, z)
+        * numpy.polyval(high_pass_b, z) / numpy.polyval(high_pass_a, z)
+    )
+
+
+def ITU_468_gain(freqs):
+    """
+    Return the gain of the ITU-R 468 noise weighting curve at the given
+    frequencies. Gain function according to Wikipedia.
+    """
+    f = numpy.asarray(freqs, dtype=numpy.float64)
+    h1 = (
+        -4.737338981378384e-24*f**6 + 2.043828333606125e-15*f**4
+        - 1.363894795463638e-07*f**2 + 1
+    )
+    h2 = (
+        1.306612257412824e-19*f**5 - 2.118150887518656e-11*f**3
+        + 5.559488023498642e-04*f
+    )
+    return 1.246332637532143e-04*f / numpy.sqrt(h1**2 + h2**2)
+
+
+weighting_gains = {
+    'A' : A_weighting_gain,
+    'C' : C_weighting_gain,
+    'K' : K_weighting_gain,
+    'ITU-468' : ITU_468_gain,
+}
+_weighting_curves = {}
+
+
+def weighting_curve(weighting='A', fft_size=0, samplerate=0, num_keys=None):
+    """
+    Return a read-only array with the power gain (squared gain) of the given
+    weighting for every key of a spectrum. Curves are calculated once per
+    weighting, FFT size and samplerate.
+    
+    Arguments:
+    weighting   One of the keys of `weighting_gains`
+    fft_size    Length of the transform the spectrum comes from
+    samplerate  Samplerate of the analyzed data
+    num_keys    Length of the spectrum, `fft_size/2+1` by default
+    """
+    if num_keys is None:
+        num_keys = fft_size//2+1
+    key = (weighting, fft_size, samplerate, num_keys)
+    if not key in _weighting_curves:
+        if not weighting in weighting_gains:
+            raise AudioAnalyzeError("Unknown weighting")
+        freqs = numpy.arange(num_keys)*(float(samplerate)/fft_size)
+        curve = weighting_gains[weighting](freqs)**2
+        curve.flags.writeable = False
+        _weighting_curves[key] = curve
+    return _weighting_curves[key]
+
+
+# Normalization
+
+class Normalizer:
+    """
+    Scale spectra so that the values from 0 - 1 are nicely used, relative to
+    the levels of the recent past. The past levels are kept in a fixed-size
+    ring buffer, so memory and time per frame stay constant.
+    
+    Attributes:
+    mode        How the level of a spectrum is measured;
+                'peak': the loudest frequency
+                'average': the average of all frequencies
+                'percentile': the `percentile`th percentile of all frequencies
+    history     Number of past levels that are considered
+    percentile  Percentile used in 'percentile' mode
+    levels      Ring buffer of past levels
+    pos         Position in `levels` the next level is written to
+    """
+    
+    mode = 'peak'
+    history = 25*5
+    percentile = 95
+    levels = None
+    pos = 0
+    
+    
+    def __init__(self, history=25*5, mode='peak', percentile=95):
+        if not mode in ('peak', 'average', 'percentile'):
+            raise AudioAnalyzeError("Unknown normalization mode")
+        self.mode = mode
+        self.history = history
+        self.percentile = percentile
+        self.levels = numpy.zeros(history)
+        # older levels count less; the weights are repeated so that a slice
+        # of them always lines up with the ring buffer
+        self._weights = numpy.tile(
+            numpy.linspace(start=1.0/history, stop=1.0, num=history), 2
+        )
+        self._weighted = numpy.empty(history)
+        self.pos = 0
+    
+    
+    def normalize(self, powers):
+        """
+        Add the level of `powers` to the history and scale `powers` in place.
+        Returns the multiplier that was used.
+        """
+        if self.mode == 'average':
+            level = numpy.mean(powers)
+        elif self.mode == 'percentile':
+            level = numpy.percentile(powers, self.percentile)
+        else:
+            level = numpy.max(powers)
+        self.levels[self.pos] = level
+        self.pos = (self.pos+1)%self.history
+        numpy.multiply(
+            self.levels,
+            self._weights[self.history-self.pos:2*self.history-self.pos],
+            out=self._weighted
+        )
+        max_level = self._weighted.max()
+        if max_level <= 0:
+            return 1.0
+        multiplier = 1.0/max_level
+        powers *= multiplier
+        return multiplier
+    
+    
+    def reset(self):
+        """
+        Forget all past levels.
+        """
+        self.levels[:] = 0
+        self.pos = 0
+        return 0
+    
+    
+    def get_state(self):
+        """
+        Return the settings and the past levels as a dictionary that can be
+        pickled.
+        """
+        return {
+            'mode' : self.mode,
+            'history' : self.history,
+            'percentile' : self.percentile,
+            'levels' : self.levels.copy(),
+            'pos' : self.pos,
+        }
+    
+    
+    @classmethod
+    def from_state(cls, state):
+        """
+        Return a `Normalizer` with a state returned by `get_state()`.
+        """
+        normalizer = cls(state['history'], state['mode'], state['percentile'])
+        normalizer.levels[:] = state['levels']
+        normalizer.pos = state['pos']
+        return normalizer
+
+
+# Filterbanks
+
+_filterbanks = {}
+
+
+def hz_to_mel(freqs):
+    return 2595*numpy.log10(1+numpy.asarray(freqs, dtype=numpy.float64)/700.0)
+
+
+def mel_to_hz(mels):
+    return 700*(10**(numpy.asarray(mels, dtype=numpy.float64)/2595.0)-1)
+
+
+def filterbank(num=20, min_freq=200, max_freq=20000, fft_size=0,
+        samplerate=0, num_keys=None, scale='log'):
+    """
+    Return a sparse matrix of shape `(num, num_keys)` of overlapping
+    triangular filters whose centers are evenly spaced between `min_freq`
+    and `max_freq` on a logarithmic or mel scale. Each row is normalized to
+    a sum of 1, so multiplying a spectrum with the matrix gives the average
+    power of every band. Bands narrower than the key spacing (low
+    frequencies) interpolate between the two keys around their center
+    instead of coming out empty. Filterbanks are built once per
+    configuration.
+    
+    Arguments:
+    num         Number of bands
+    min_freq    Lower edge of the first band in Hz
+    max_freq    Upper edge of the last band in Hz
+    fft_size    Length of the transform the spectra come from
+    samplerate  Samplerate of the analyzed data
+    num_keys    Length of the spectra, `fft_size/2+1` by default
+    scale       'log' or 'mel'
+    """
+    if num_keys is None:
+        num_keys = fft_size//2+1
+    key = (num, min_freq, max_freq, fft_size, samplerate, num_keys, scale)
+    if key in _filterbanks:
+        return _filterbanks[key]
+    if scale == 'mel':
+        edges = mel_to_hz(numpy.linspace(
+            hz_to_mel(min_freq), hz_to_mel(max_freq), num+2
+        ))
+    elif scale == 'log':
+        edges = numpy.logspace(
+            math.log10(max(min_freq, 1)), math.log10(max_freq), num+2
+        )
+    else:
+        raise AudioAnalyzeError("Unknown filterbank scale")
+    key_spacing = float(samplerate)/fft_size
+    key_freqs = numpy.arange(num_keys)*key_spacing
+    rows = []
+    cols = []
+    values = []
+    for i in range(0, num):
+        low, center, high = edges[i:i+3]
+        first = max(int(math.ceil(low/key_spacing)), 0)
+        last = min(int(high/key_spacing), num_keys-1)
+        freqs = key_freqs[first:last+1]
+        weights = numpy.minimum(
+            (freqs-low)/(center-low), (high-freqs)/(high-center)
+        )
+        keys = numpy.arange(first, last+1)[weights > 0]
+        weights = weights[weights > 0]
+        if not len(keys): # band falls between two keys
+            position = min(center/key_spacing, num_keys-1)
+            below = int(position)
+            keys = numpy.array([below, min(below+1, num_keys-1)])
+            weights = numpy.array([1-(position-below), position-below])
+        rows.append(numpy.zeros(len(keys), dtype=numpy.intp)+i)
+        cols.append(keys)
+        values.append(weights/weights.sum())
+    matrix = scipy.sparse.csr_matrix(
+        (
+            numpy.concatenate(values),
+            (numpy.concatenate(rows), numpy.concatenate(cols))
+        ),
+        shape=(num, num_keys)
+    )
+    _filterbanks[key] = matrix
+    return matrix
+
+
+def apply_filterbank(matrix, powers):
+    """
+    Return the band powers of one spectrum (1-D) or of a batch of spectra
+    (2-D, one spectrum per row) for a matrix from `filterbank()`.
+    """
+    if powers.ndim == 1:
+        return matrix.dot(powers)
+    return matrix.dot(powers.T).T
+
+
+# FFT backends
+
+class FFTBackend:
+    """
+    Real FFTs through `numpy.fft` or `scipy.fft`. Frames are zero-padded to
+    lengths that transform fast (see `fast_size()`) in input buffers that are
+    kept per shape, so padding doesn't allocate. Every thread has buffers of
+    its own, and only the `max_buffers` most recently used shapes are kept
+    per thread. The backend and size of the last transform are recorded,
+    e.g. to compare backends; give every analyzer a backend of its own to
+    keep them apart.
+    
+    Attributes:
+    backend     'numpy' or 'scipy'
+    workers     Number of threads `scipy.fft` transforms 2-D input with
+    pad         Wether `fast_size()` pads at all
+    max_buffers Number of padded input buffers kept per thread
+    last_backend Backend of the last transform
+    last_size   Length of the last transform
+    last_count  Number of frames in the last transform
+    """
+    
+    backend = 'numpy'
+    workers = 1
+    pad = True
+    max_buffers = 4
+    last_backend = None
+    last_size = 0
+    last_count = 0
+    
+    
+    def __init__(self, backend=None, workers=1, pad=True, max_buffers=4):
+        """
+        Arguments:
+        backend     'numpy', 'scipy' (needs SciPy 1.4 or newer), or None for
+                    'scipy' if it is available and 'numpy' otherwise
+        workers     Number of threads for 2-D input ('scipy' only; -1 for
+                    all processors)
+        pad         Wether to pad frames to fast sizes
+        max_buffers Number of padded input buffers kept per thread
+        """
+        if backend is None:
+            backend = 'scipy' if _scipy_fft else 'numpy'
+        if backend == 'scipy' and not _scipy_fft:
+            raise AudioAnalyzeError("scipy.fft needs SciPy 1.4 or newer")
+        if not backend in ('numpy', 'scipy'):
+            raise AudioAnalyzeError("Unknown FFT backend")
+        self.backend = backend
+        self.workers = workers
+        self.pad = pad
+        self.max_buffers = max_buffers
+        self._local = threading.local()
+    
+    
+    def fast_size(self, size):
+        """
+        Return the smallest even length of at least `size` that only has the
+        prime factors 2, 3 and 5 (or `size` itself if padding is off). Even
+        lengths keep `fft_size == 2*(num_keys-1)`.
+        """
+        if not self.pad or size < 2:
+            return size
+        if _scipy_fft:
+            return 2*_scipy_fft.next_fast_len((size+1)//2, real=True)
+        return 2*scipy.fftpack.next_fast_len((size+1)//2)
+    
+    
+    def rfft(self, frame, size=None):
+        """
+        Return the FFT of the real `frame` (or of every row of a 2-D array)
+        zero-padded to `size`.
+        """
+        length = frame.shape[-1]
+        if size is None:
+            size = length
+        if size > length:
+            padded = self._buffer(frame.shape, size)
+            padded[..., :length] = frame
+            frame = padded
+        if self.backend == 'scipy':
+            spectrum = _scipy_fft.rfft(
+                frame, size, workers=self.workers if frame.ndim > 1 else None
+            )
+        else:
+            spectrum = numpy.fft.rfft(frame, size)
+        self.last_backend = self.backend
+        self.last_size = size
+        self.last_count = frame.size//frame.shape[-1]
+        return spectrum
+    
+    
+    def _buffer(self, shape, size):
+        """
+        Return this thread's zero-padded input buffer for frames of the
+        given shape.
+        """
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = self._local.buffers = collections.OrderedDict()
+        key = (shape, size)
+        padded = buffers.pop(key, None)
+        if padded is None:
+            while len(buffers) >= max(self.max_buffers, 1):
+                buffers.popitem(last=False) # least recently used
+            # the padding is never written, so it stays zero
+            padded = numpy.zeros(shape[:-1]+(size,))
+        buffers[key] = padded # most recently used last
+        return padded
+
+
+fft_backend = FFTBackend()
+
+
+# Short-time Fourier transform
+
+_windows = {}
+
+
+def get_window(window='hann', size=0):
+    """
+    Return a read-only window of the given size. Windows are calculated once
+    per window and size.
+    
+    Arguments:
+    window  Name of a window understood by `scipy.signal.get_window()`, a
+            function that returns a window of a given size (e.g.
+            `scipy.signal.hanning`), or None for a rectangular window
+    size    Length of the window
+    """
+    if window is None:
+        window = 'boxcar'
+    key = (window, size)
+    if not key in _windows:
+        if callable(window):
+            values = numpy.asarray(window(size), dtype=numpy.float64)
+        else:
+            values = scipy.signal.get_window(window, size)
+        values.flags.writeable = False
+        _windows[key] = values
+    return _windows[key]
+
+
+def power_spectrum(frame, window, out=None, fft_size=None, backend=None):
+    """
+    Return the power spectral density of one frame of samples, scaled the
+    same way as `AudioAnalyze.analyze()` does: like a one-sided
+    `scipy.signal.welch()` of a single segment, divided by half the frame
+    length. The frame's mean is removed first. A 2-D array of frames (one
+    per row) is transformed at once. Zero-padding to `fft_size` only makes
+    the keys denser; it doesn't change the scaling.
+    
+    Arguments:
+    frame       Samples; modified in place (mean removal, windowing)
+    window      Window of the same length as `frame`
+    out         Array of length `fft_size/2+1` to write to (optional)
+    fft_size    Length of the transform (default: length of `frame`)
+    backend     `FFTBackend` to use (default: `fft_backend`)
+    """
+    size = frame.shape[-1]
+    if fft_size is None:
+        fft_size = size
+    frame -= frame.mean(axis=-1, keepdims=True)
+    frame *= window
+    spectrum = (backend or fft_backend).rfft(frame, fft_size)
+    if out is None:
+        out = numpy.empty(spectrum.shape)
+    numpy.multiply(spectrum.real, spectrum.real, out=out)
+    out += spectrum.imag**2
+    out *= 2.0/numpy.sum(window**2)/(size/2.0)
+    out[..., 0] /= 2 # DC and Nyquist keys have no mirrored negative freq.
+    if fft_size%2 == 0:
+        out[..., -1] /= 2
+    return out
+
+
+class STFT:
+    """
+    Streaming short-time Fourier transform. Samples are fed in blocks of any
+    size, and a spectrum is produced every `hop` samples from the last
+    `window_size` samples. The analysis cost per spectrum only depends on
+    `window_size`, not on the frame rate or the block size.
+    
+    Attributes:
+    window_size Length of the analyzed windows; a power of two
+    hop         Number of samples between the starts of two windows
+    window      Window function values (see `get_window()`)
+    samplerate  Samplerate of the samples; key `k` of a spectrum is the
+                frequency `k*samplerate/window_size`
+    backend     `FFTBackend` the spectra are calculated with
+    """
+    
+    window_size = 2048
+    hop = 1024
+    window = None
+    samplerate = 0
+    backend = None
+    
+    
+    def __init__(self, window_size=2048, hop=None, overlap=0.5,
+            window='hann', samplerate=44100, backend=None):
+        """
+        Arguments:
+        window_size Length of the analyzed windows; a power of two
+        hop         Number of samples between two windows...
+        overlap     or the fraction of a window that overlaps with the next
+        window      Window to use (see `get_window()`)
+        samplerate  Samplerate of the samples
+        backend     `FFTBackend` to use (default: one of its own)
+        """
+        if window_size < 2 or window_size & (window_size-1):
+            raise AudioAnalyzeError("Window size must be a power of two")
+        if not hop:
+            hop = int(window_size*(1-overlap))
+        if hop < 1 or hop > window_size:
+            raise AudioAnalyzeError("Hop must be between 1 and window size")
+        self.window_size = window_size
+        self.hop = hop
+        self.window = get_window(window, window_size)
+        self.samplerate = samplerate
+        self.backend = backend or FFTBackend()
+        self._samples = numpy.zeros(window_size)
+        self._frame = numpy.empty(window_size)
+        self._powers = numpy.empty(window_size//2+1)
+        self._until_hop = hop
+    
+    
+    def stream(self, blocks):
+        """
+        Generator that yields a spectrum (see `power_spectrum()`) every `hop`
+        samples of the given iterable of sample blocks. The stream starts
+        with a window of silence, so the `n`th spectrum covers the samples
+        up to `(n+1)*hop`. The yielded array is reused for the next spectrum;
+        copy it to keep it.
+        """
+        for block in blocks:
+            i = 0
+            while i < len(block):
+                n = min(self._until_hop, len(block)-i)
+                self._samples[:-n] = self._samples[n:]
+                self._samples[-n:] = block[i:i+n]
+                self._until_hop -= n
+                i += n
+                if not self._until_hop:
+                    self._until_hop = self.hop
+                    yield self.spectrum()
+    
+    
+    def spectrum(self):
+        """
+        Return the spectrum of the last `window_size` samples fed.
+        """
+        self._frame[...] = self._samples
+        return power_spectrum(
+            self._frame, self.window, self._powers, backend=self.backend
+        )
+    
+    
+    def reset(self):
+        """
+        Forget all samples fed so far.
+        """
+        self._samples[...] = 0
+        self._until_hop = self.hop
+        return 0
+
+
+# Constant-Q transform
+
+_cq_kernels = {}
+
+
+def constant_q_kernel(min_freq, bins_per_octave=12, samplerate=44100,
+        window='hann', threshold=0.0054):
+    """
+    Return the spectral kernel of one octave of a constant-Q transform as a
+    tuple `(matrix, fft_size)`: a sparse matrix of shape
+    `(bins_per_octave, fft_size/2+1)` that turns the `numpy.fft.rfft()` of
+    `fft_size` samples into the complex amplitudes of `bins_per_octave` bins
+    starting at `min_freq`, each measured at the middle of the samples
+    (after Brown and Puckette). A sinusoid at a bin's frequency comes out
+    with its amplitude. Kernels are built once per configuration.
+    
+    Arguments:
+    min_freq        Frequency of the first bin in Hz
+    bins_per_octave Number of bins in the octave
+    samplerate      Samplerate of the transformed samples
+    window          Window the bins are weighted with (see `get_window()`)
+    threshold       Kernel values below this fraction of the largest value
+                    are dropped
+    """
+    key = (min_freq, bins_per_octave, samplerate, window, threshold)
+    if key in _cq_kernels:
+        return _cq_kernels[key]
+    if min_freq*2 > samplerate/2.0:
+        raise AudioAnalyzeError("Constant-Q bins above the Nyquist frequency")
+    q = 1/(2**(1.0/bins_per_octave)-1)
+    fft_size = 1
+    while fft_size < q*samplerate/min_freq:
+        fft_size *= 2
+    kernels = numpy.zeros((bins_per_octave, fft_size), dtype=numpy.complex128)
+    for i in range(0, bins_per_octave):
+        freq = min_freq*2**(float(i)/bins_per_octave)
+        length = int(math.ceil(q*samplerate/freq))
+        start = (fft_size-length)//2
+        weights = get_window(window, length)
+        kernels[i, start:start+length] = weights/weights.sum()*numpy.exp(
+            2j*math.pi*freq/samplerate*(numpy.arange(length)-length/2.0)
+        )
+    # conjugated spectra, scaled so that kernel.dot(rfft) is the correlation
+    spectra = numpy.conj(numpy.fft.fft(kernels, axis=1))/fft_size
+    spectra = spectra[:, :fft_size//2+1]*2 # rfft omits the mirrored half
+    spectra[numpy.abs(spectra) < threshold*numpy.abs(spectra).max()] = 0
+    _cq_kernels[key] = (scipy.sparse.csr_matrix(spectra), fft_size)
+    return _cq_kernels[key]
+
+
+class ConstantQ:
+    """
+    Constant-Q transform: bins spaced evenly on a logarithmic scale, each as
+    wide as its distance to the next, so low frequencies get as many bins per
+    octave as high ones. Only the kernel of the highest octave is built;
+    every lower octave applies the same kernel to the samples decimated by
+    another factor of two, so the cost is about that of a few short FFTs
+    instead of one zero-padded FFT long enough for the lowest bin.
+    
+    The lowest octave needs `fft_size*2**(octaves-1)` samples around the
+    middle of the frame for its full resolution; shorter frames are padded
+    with zeros, which smears the low bins.
+    
+    Attributes:
+    min_freq        Frequency of the lowest bin in Hz
+    bins_per_octave Number of bins per octave
+    octaves         Number of octaves
+    samplerate      Samplerate of the transformed samples
+    frequencies     Center frequencies of all bins, lowest first
+    kernel          Sparse spectral kernel of the highest octave
+    fft_size        Transform length of the highest octave
+    """
+    
+    min_freq = 32.7
+    bins_per_octave = 12
+    octaves = 7
+    samplerate = 44100
+    frequencies = None
+    kernel = None
+    fft_size = 0
+    
+    
+    def __init__(self, min_freq=32.7, bins_per_octave=12, octaves=7,
+            samplerate=44100, window='hann'):
+        """
+        Arguments:
+        min_freq        Frequency of the lowest bin in Hz (default: C1)
+        bins_per_octave Number of bins per octave
+        octaves         Number of octaves
+        samplerate      Samplerate of the transformed samples
+        window          Window the bins are weighted with
+        """
+        self.min_freq = min_freq
+        self.bins_per_octave = bins_per_octave
+        self.octaves = octaves
+        self.samplerate = samplerate
+        self.kernel, self.fft_size = constant_q_kernel(
+            min_freq*2**(octaves-1), bins_per_octave, samplerate, window
+        )
+        self.frequencies = min_freq*2**(
+            numpy.arange(octaves*bins_per_octave)/float(bins_per_octave)
+        )
+        self._frame = numpy.empty(self.fft_size)
+    
+    
+    def transform(self, samples, out=None):
+        """
+        Return the powers of all bins, lowest first, for the middle of
+        `samples`.
+        
+        Arguments:
+        samples     Samples at `samplerate`
+        out         Array of length `len(frequencies)` to write to (optional)
+        """
+        if out is None:
+            out = numpy.empty(len(self.frequencies))
+        samples = numpy.asarray(samples, dtype=numpy.float64)
+        bins = self.bins_per_octave
+        for octave in range(self.octaves-1, -1, -1):
+            if octave < self.octaves-1:
+                # only decimate what the remaining octaves need, plus some
+                # margin for the filter
+                samples = scipy.signal.resample_poly(
+                    self._crop(samples, self.fft_size*2**(octave+1)+128), 1, 2
+                )
+            self._center(samples)
+            amplitudes = self.kernel.dot(fft_backend.rfft(self._frame))
+            powers = out[octave*bins:(octave+1)*bins]
+            numpy.multiply(amplitudes.real, amplitudes.real, out=powers)
+            powers += amplitudes.imag**2
+        return out
+    
+    
+    def _crop(self, samples, size):
+        """
+        Return at most `size` samples around the middle of `samples`.
+        """
+        start = max((len(samples)-size)//2, 0)
+        return samples[start:start+size]
+    
+    
+    def _center(self, samples):
+        """
+        Copy `fft_size` samples around the middle of `samples` to the frame,
+        padding with zeros.
+        """
+        self._frame[...] = 0
+        start = (len(samples)-self.fft_size)//2
+        if start >= 0:
+            self._frame[...] = samples[start:start+self.fft_size]
+        else:
+            self._frame[-start:-start+len(samples)] = samples
+        return 0
+
+
+# Peak picking
+
+def find_peaks(powers, k=1, min_key=0, max_key=None):
+    """
+    Return the `k` strongest local maxima of a spectrum between `min_key` and
+    `max_key` (exclusive) as a tuple of arrays `(keys, powers)`, strongest
+    first. Only keys in the range are compared, so a key at an end of the
+    range is a maximum if it is larger than the key next to it inside (the
+    largest value of a range on a slope is found that way). The keys are
+    fractional: every peak between two keys of the range is refined by
+    fitting a parabola through the log powers of its key and the two next to
+    it. Only the `k` strongest peaks get sorted, so this takes linear time.
+    
+    Arguments:
+    powers      Spectrum
+    k           Maximum number of peaks
+    min_key     First key of the range
+    max_key     Key after the last key of the range (default: the end)
+    """
+    powers = numpy.asarray(powers, dtype=numpy.float64)
+    if max_key is None:
+        max_key = len(powers)
+    min_key = max(min_key, 0)
+    max_key = min(max_key, len(powers))
+    if max_key <= min_key or k < 1:
+        return numpy.zeros(0), numpy.zeros(0)
+    # neighbours beyond the ends of the range never win
+    region = numpy.concatenate(
+        ([-numpy.inf], powers[min_key:max_key], [-numpy.inf])
+    )
+    centers = region[1:-1]
+    candidates = numpy.flatnonzero(
+        (centers >= region[:-2]) & (centers > region[2:])
+    )
+    if not len(candidates): # only NaNs and infinities
+        candidates = numpy.array([numpy.argmax(centers)])
+    candidates += min_key
+    if len(candidates) > k:
+        candidates = candidates[
+            numpy.argpartition(-powers[candidates], k-1)[:k]
+        ]
+    candidates = candidates[numpy.argsort(-powers[candidates])]
+    keys = candidates.astype(numpy.float64)
+    peak_powers = powers[candidates]
+    # keys at the ends of the range stay where they are, so the refined
+    # keys stay inside the range
+    inner = (candidates > min_key) & (candidates < max_key-1)
+    if numpy.any(inner):
+        around = candidates[inner]
+        logs = numpy.log(numpy.maximum(
+            powers[around[:, numpy.newaxis]+numpy.arange(-1, 2)], 1e-300
+        ))
+        left, center, right = logs[:, 0], logs[:, 1], logs[:, 2]
+        curvature = left-2*center+right
+        offsets = numpy.zeros(len(around))
+        curved = curvature < 0
+        offsets[curved] = numpy.clip(
+            0.5*(left-right)[curved]/curvature[curved], -0.5, 0.5
+        )
+        keys[inner] += offsets
+        peak_powers[inner] = numpy.exp(center-0.25*(left-right)*offsets)
+    return keys, peak_powers
+
+
+class PeakTracker:
+    """
+    Follow spectral peaks from frame to frame. Every peak of a new frame
+    continues the closest track within `tolerance` semitones, strongest
+    peaks first; peaks that match no track start a new one. Tracks that
+    weren't continued for `max_age` frames are dropped.
+    
+    Attributes:
+    tolerance   Largest distance in semitones between a track and a peak
+                that continues it
+    max_age     Number of frames a track survives without a peak
+    tracks      Dictionary of track id -> `[frequency, power, age]`, where
+                age is the number of frames since the track's last peak
+    next_id     Id of the next new track
+    """
+    
+    tolerance = 0.5
+    max_age = 5
+    tracks = None
+    next_id = 0
+    
+    
+    def __init__(self, tolerance=0.5, max_age=5):
+        self.tolerance = tolerance
+        self.max_age = max_age
+        self.tracks = {}
+    
+    
+    def update(self, peaks):
+        """
+        Match the peaks of a new frame to the tracks; return a list of tuples
+        `(track id, frequency, power)` in the order of `peaks`.
+        
+        Arguments:
+        peaks       List of tuples `(frequency, power)`, strongest first (as
+                    returned by `AudioAnalyze.peaks()`)
+        """
+        for track in self.tracks.values():
+            track[2] += 1
+        free = set(self.tracks)
+        out = []
+        for freq, power in peaks:
+            match = None
+            distance = self.tolerance
+            for track_id in free:
+                track_distance = abs(12*math.log(
+                    max(freq, 1e-9)/max(self.tracks[track_id][0], 1e-9), 2
+                ))
+                if track_distance <= distance:
+                    match = track_id
+                    distance = track_distance
+            if match is None:
+                match = self.next_id
+                self.next_id += 1
+            else:
+                free.discard(match)
+            self.tracks[match] = [freq, power, 0]
+            out.append((match, freq, power))
+        for track_id in list(self.tracks):
+            if self.tracks[track_id][2] > self.max_age:
+                del self.tracks[track_id]
+        return out
+    
+    
+    def reset(self):
+        """
+        Drop all tracks.
+        """
+        self.tracks = {}
+        return 0
+
+
+# Spectrograms analyzed while they are read
+
+class BatchSpectrogram:
+    """
+    Spectrogram of a whole file for `AudioAnalyze.use_spectrogram()` that is
+    only analyzed (with `AudioAnalyze.analyze_batch()`) `chunk_size` rows at
+    a time, when a row of the chunk is read. Only one chunk is kept, so
+    memory doesn't grow with the length of the file, as long as the rows
+    are read mostly in order (e.g. while rendering).
+    
+    Attributes:
+    analyzer    `AudioAnalyze` the file is analyzed with
+    fps         Frames per second
+    frames      Number of rows (as many as `analyze_batch()` returns)
+    chunk_size  Number of rows analyzed at once
+    """
+    
+    analyzer = None
+    fps = 30
+    frames = 0
+    chunk_size = 256
+    
+    
+    def __init__(self, analyzer, fps=30, window_func='hann',
+            A_weighting=False, weighting=None, frame_size=None,
+            chunk_size=256, dtype=numpy.float32):
+        """
+        Arguments:
+        analyzer    `AudioAnalyze` with an open WAV file
+        fps, window_func, A_weighting, weighting, frame_size, dtype
+                    See `AudioAnalyze.analyze_batch()`
+        chunk_size  Number of rows analyzed at once
+        """
+        self.analyzer = analyzer
+        self.fps = fps
+        self.frames = int(math.ceil(analyzer.wave_duration()*fps))+1
+        self.chunk_size = chunk_size
+        self._params = {
+            'fps' : fps,
+            'window_func' : window_func,
+            'A_weighting' : A_weighting,
+            'weighting' : weighting,
+            'frame_size' : frame_size,
+            'chunk_size' : chunk_size,
+            'dtype' : dtype,
+        }
+        self._start = 0
+        self._chunk = None
+    
+    
+    def __len__(self):
+        return self.frames
+    
+    
+    def __getitem__(self, row):
+        if row < 0:
+            row += self.frames
+        if row < 0 or row >= self.frames:
+            raise IndexError("Row out of range")
+        if self._chunk is None or row < self._start \
+                or row >= self._start+len(self._chunk):
+            self._start = row-row%self.chunk_size
+            self._chunk = None # free the old chunk first
+            self._chunk = self.analyzer.analyze_batch(
+                self._start, min(self._start+self.chunk_size, self.frames),
+                **self._params
+            )
+        return self._chunk[row-self._start]
+
+
+# Analysis snapshots
+
+_AnalysisFrame = collections.namedtuple(
+    'AnalysisFrame',
+    ('data', 'freq_powers', 'samplerate', 'fft_size', 'timestamp', 'index')
+)
+
+
+class AnalysisFrame(_AnalysisFrame):
+    """
+    Immutable snapshot of an analysis result, as published by the thread
+    that analyzes and read by the ones that draw. The arrays are read-only
+    views; the analyzing side must not modify the arrays afterwards (which
+    `AudioAnalyze` doesn't, because it creates new arrays for every frame).
+    
+    Fields:
+    data        Samples that were analyzed
+    freq_powers Spectrum (see `AudioAnalyze.freq_powers`)
+    samplerate  Samplerate of `data`
+    fft_size    Transform length of `freq_powers`
+    timestamp   Time the samples were recorded or played at
+    index       Number of the frame
+    """
+    
+    __slots__ = ()
+    
+    
+    def __new__(cls, data, freq_powers, samplerate, fft_size, timestamp=0.0,
+            index=0):
+        return _AnalysisFrame.__new__(
+            cls, _readonly(data), _readonly(freq_powers), samplerate,
+            fft_size, timestamp, index
+        )
+
+
+def _readonly(array):
+    view = numpy.asarray(array).view()
+    view.flags.writeable = False
+    return view
+
+
+class AnalysisBuffer:
+    """
+    Double buffer of `AnalysisFrame`s. The analyzing thread calls
+    `publish()`, which swaps the new frame to the front with a single
+    reference assignment; readers call `latest()` once per frame and use the
+    returned snapshot throughout. Neither side ever waits for the other and
+    nothing is copied.
+    
+    Attributes:
+    front       Most recently published frame (or None)
+    back        Frame that was published before it
+    """
+    
+    front = None
+    back = None
+    
+    
+    def publish(self, frame):
+        """
+        Make `frame` the latest frame.
+        """
+        self.back = self.front
+        self.front = frame # a single, atomic assignment
+        return 0
+    
+    
+    def latest(self):
+        """
+        Return the latest frame, or None if nothing was published yet.
+        """
+        return self.front
+
 
 class AudioAnalyze:
     """
@@ -18,11 +1480,29 @@ class AudioAnalyze:
                     wave over time
     data_samplerate Rate at which `data` was sampled (samples per second)
     data_*          Wave information (nchannels, sampwidth, etc)
+    data_float      Wether the samples are IEEE floats instead of integers
+    downmix         Wether to average all channels when parsing instead of
+                    using only the first one
     freq_powers     A list containing the power for each frequency
-    file_           A wave object that this class can read wave data from
-    
-    normalization   List of past normalization values (multipliers; 1=unchanged)
-    normalization_len How many seconds of past to consider for normalization
+    fft_size        Length of the transform `freq_powers` was calculated with;
+                    the frequency of key `k` is `k*data_samplerate/fft_size`
+    fft_backend     `FFTBackend` the spectra are calculated with
+    spectrogram     Precalculated `freq_powers` for every frame of the file,
+                    e.g. from a `spectrumcache.SpectrumCache` (or None)
+    spectrogram_fps Frames per second of `spectrogram`
+    spectrogram_fft_size Length of the transform of the `spectrogram` rows
+    bin_layouts     Cache of `BinLayout`s used by `freq_bin_powers()`
+    bin_lists       Cache of lists returned by `linear_bins()` and
+                    `logarithmic_bins()`
+    cq_powers       Powers of the log spaced bins from `constant_q()`
+    cq_freqs        Center frequencies of `cq_powers`
+    constant_qs     Cache of `ConstantQ`s used by `constant_q()`
+    file_           A `WaveStream` that this class can read wave data from
+    map_            A `WaveMap` that this class reads wave data from instead
+                    of `file_` if the file could be memory-mapped
+    pos             Position in `map_` in frames
+    normalizer      `Normalizer` used by `normalize()`
+    frame_index     Number of snapshots taken with `snapshot()`
     """
     
     data = []
@@ -31,40 +1511,287 @@ class AudioAnalyze:
     data_sampwidth = 0
     data_framerate = 0
     data_nframes = 0
+    data_float = False
+    downmix = False
     
     freq_powers = []
+    fft_size = 0
+    fft_backend = None
+    spectrogram = None
+    spectrogram_fps = 0
+    spectrogram_fft_size = None
+    bin_layouts = None
+    bin_lists = None
+    cq_powers = None
+    cq_freqs = None
+    constant_qs = None
     file_ = None
+    map_ = None
+    pos = 0
     
-    max_powers = []
-    max_powers_len = 2**24
+    normalizer = None
+    frame_index = 0
     
     # Audio analysis functions
     
-    def analyze(self, window_func=scipy.signal.hanning, A_weighting=False):
+    def analyze(self, window_func='hann', A_weighting=False, weighting=None):
         """
         Calculate the powers of the frequencies that are in the wave
         `wave_data`.
         
         Arguments:
         window_func A windowing function that returns a list that gets
-                    multiplied with the data, or None
+                    multiplied with the data, the name of a window, or None
+                    (see `get_window()`)
         A_weighting Wether to perform A_weighting on the data or not
+        weighting   Frequency weighting to perform instead ('A', 'C', 'K' or
+                    'ITU-468'; see `weighting_curve()`), or None
         """
-        window_func = None
-        if window_func:
-            window = window_func(len(self.data))
-        else:
-            window = 'boxcar'
-        periodogram = scipy.signal.welch(
-            self.data, window=window, scaling='density'
-        )
-        self.freq_powers = periodogram[1] / (len(self.data)/2.0)
+        window = get_window(window_func, len(self.data))
+        self.fft_size = self.fft_backend.fast_size(len(self.data))
         # Power Spectral Density - normalized with 2*N instead of just N 
         # because of FFT implementation optimizations
-        if A_weighting:
-            for key, power in enumerate(self.freq_powers):
-                freq = self.key_to_freq(key)
-                self.freq_powers[key] = self.A_weighting(power, freq)
+        self.freq_powers = power_spectrum(
+            numpy.array(self.data, dtype=numpy.float64), window,
+            fft_size=self.fft_size, backend=self.fft_backend
+        )
+        if A_weighting and not weighting:
+            weighting = 'A'
+        if weighting:
+            self.freq_powers *= weighting_curve(
+                weighting, self.fft_size, self.data_samplerate,
+                len(self.freq_powers)
+            )
+        return 0
+    
+    
+    def stft_stream(self, window_size=2048, hop=None, window='hann',
+        weighting=None, block_size=4096):
+        """
+        Generator that analyzes the file from the current position on with
+        a `STFT` and yields the time in seconds at the end of every window.
+        While the generator is suspended, `freq_powers` contains the
+        spectrum of that window (the array is reused for the next one).
+        
+        Arguments:
+        window_size Length of the analyzed windows; a power of two
+        hop         Number of samples between two windows (default: half
+                    a window)
+        window      Window to use (see `get_window()`)
+        weighting   Frequency weighting to perform (see `analyze()`)
+        block_size  Number of frames read from the file at once
+        """
+        stft = STFT(
+            window_size, hop, window=window, samplerate=self.data_samplerate,
+            backend=self.fft_backend
+        )
+        start = self.wave_getpos()
+        def blocks():
+            while self.wave_getpos() < self.data_nframes:
+                self.wave_read(frames=min(
+                    block_size, self.data_nframes-self.wave_getpos()
+                ))
+                yield self.data
+        for i, powers in enumerate(stft.stream(blocks())):
+            self.freq_powers = powers
+            self.fft_size = window_size
+            if weighting:
+                self.freq_powers *= weighting_curve(
+                    weighting, window_size, self.data_samplerate
+                )
+            yield (start+(i+1)*stft.hop)/float(self.data_samplerate)
+    
+    
+    def constant_q(self, min_freq=32.7, bins_per_octave=12, octaves=7,
+        weighting=None):
+        """
+        Analyze `data` with a constant-Q transform (see `ConstantQ`) and
+        return the powers of the log spaced bins, lowest first. The bin
+        frequencies are in `cq_freqs`. `data` should be long enough for the
+        lowest octave, e.g. read with `wave_read(frames=...)`.
+        
+        Arguments:
+        min_freq        Frequency of the lowest bin in Hz
+        bins_per_octave Number of bins per octave
+        octaves         Number of octaves
+        weighting       Frequency weighting to perform (see `analyze()`)
+        """
+        if self.data is None or not len(self.data):
+            raise AudioAnalyzeError("No data to analyze")
+        key = (min_freq, bins_per_octave, octaves, self.data_samplerate)
+        if not key in self.constant_qs:
+            self.constant_qs[key] = ConstantQ(
+                min_freq, bins_per_octave, octaves, self.data_samplerate
+            )
+        transform = self.constant_qs[key]
+        self.cq_powers = transform.transform(self.data)
+        self.cq_freqs = transform.frequencies
+        if weighting:
+            if not weighting in weighting_gains:
+                raise AudioAnalyzeError("Unknown weighting")
+            self.cq_powers *= weighting_gains[weighting](self.cq_freqs)**2
+        return self.cq_powers
+    
+    
+    def analyze_batch(self, start=0, stop=None, fps=30, window_func='hann',
+        A_weighting=False, weighting=None, frame_size=None, chunk_size=256,
+        dtype=numpy.float32):
+        """
+        Analyze a range of frames at once and return a `(frames, keys)`
+        array with the same spectra that `wave_seek(i/fps)`,
+        `wave_read(1.0/fps)` and `analyze()` would give for every frame `i`.
+        Frames are cut out of the samples with strides and transformed
+        together, `chunk_size` frames at a time to bound memory. Frames
+        that reach beyond the end of the file are padded with silence. The
+        read position is restored afterwards.
+        
+        Arguments:
+        start       First frame
+        stop        Frame after the last frame (default: one past the end
+                    of the file, so every frame a render draws is covered)
+        fps         Frames per second
+        window_func, A_weighting, weighting
+                    See `analyze()`
+        frame_size  Number of samples per frame (default: `1/fps` seconds)
+        chunk_size  Number of frames transformed at once
+        dtype       Data type of the returned array
+        """
+        if stop is None:
+            stop = int(math.ceil(self.wave_duration()*fps))+1
+        if not frame_size:
+            frame_size = self.frame_size(fps)
+        if A_weighting and not weighting:
+            weighting = 'A'
+        window = get_window(window_func, frame_size)
+        fft_size = self.fft_backend.fast_size(frame_size)
+        num_keys = fft_size//2+1
+        out = numpy.zeros((max(stop-start, 0), num_keys), dtype=dtype)
+        pos = self.wave_getpos()
+        for chunk_start in range(start, stop, chunk_size):
+            frames = numpy.arange(
+                chunk_start, min(chunk_start+chunk_size, stop)
+            )
+            offsets = (
+                frames/float(fps)*self.data_framerate
+            ).astype(numpy.intp)
+            samples = self._read_frames(
+                offsets[0], offsets[-1]-offsets[0]+frame_size
+            ).astype(numpy.float64)
+            offsets -= offsets[0]
+            hop = offsets[1] if len(offsets) > 1 else 0
+            if numpy.all(offsets == numpy.arange(len(offsets))*hop):
+                # evenly spaced frames are views into the samples
+                windows = numpy.lib.stride_tricks.as_strided(
+                    samples,
+                    shape=(len(offsets), frame_size),
+                    strides=(hop*samples.strides[0], samples.strides[0])
+                ).copy() # power_spectrum() works in place
+            else:
+                windows = samples[
+                    offsets[:, numpy.newaxis]+numpy.arange(frame_size)
+                ]
+            powers = power_spectrum(
+                windows, window, fft_size=fft_size, backend=self.fft_backend
+            )
+            if weighting:
+                powers *= weighting_curve(
+                    weighting, fft_size, self.data_samplerate
+                )
+            out[frames-start] = powers
+        self.wave_setpos(pos)
+        self.fft_size = fft_size
+        return out
+    
+    
+    def frame_size(self, fps=30):
+        """
+        Return the number of samples `wave_read(1.0/fps)` reads.
+        """
+        return int((1.0/fps)*self.data_framerate)
+    
+    
+    def _read_frames(self, start, count):
+        """
+        Return `count` parsed frames from frame `start` on as a float32
+        array, padded with silence beyond the end of the file. Moves the
+        read position.
+        """
+        out = numpy.zeros(count, dtype=numpy.float32)
+        available = min(count, self.data_nframes-start)
+        if available <= 0:
+            return out
+        if self.map_:
+            pcm_to_float(
+                self.map_.window(start=start, frames=available),
+                self.downmix, out[:available]
+            )
+        else:
+            self.wave_setpos(start)
+            self.wave_read(frames=available)
+            out[:available] = self.data
+        return out
+    
+    
+    def snapshot(self, timestamp=0.0):
+        """
+        Return the current `data` and `freq_powers` as an `AnalysisFrame`.
+        """
+        self.frame_index += 1
+        return AnalysisFrame(
+            self.data, self.freq_powers, self.data_samplerate, self.fft_size,
+            timestamp, self.frame_index
+        )
+    
+    
+    def load_frame(self, frame):
+        """
+        Make the contents of an `AnalysisFrame` the current analysis result,
+        without copying. `freq_powers` is read-only afterwards.
+        """
+        self.data = frame.data
+        self.freq_powers = frame.freq_powers
+        self.data_samplerate = frame.samplerate
+        self.data_framerate = frame.samplerate
+        self.fft_size = frame.fft_size
+        return 0
+    
+    
+    def use_spectrogram(self, spectrogram=None, fps=30, fft_size=None):
+        """
+        Serve `freq_powers` from a precalculated spectrogram (one row per
+        frame) instead of analyzing `data`; see `spectrogram_read()`.
+        Pass None to stop using it.
+        
+        Arguments:
+        spectrogram Array with one spectrum per row, e.g. from
+                    `analyze_batch()`, or a `BatchSpectrogram`
+        fps         Frames per second of the spectrogram
+        fft_size    Length of the transform of the spectra (default: even
+                    length that matches the number of keys)
+        """
+        self.spectrogram = spectrogram
+        self.spectrogram_fps = fps
+        self.spectrogram_fft_size = fft_size
+        return 0
+    
+    
+    def spectrogram_read(self, time=0.0):
+        """
+        Set `freq_powers` to the row of `spectrogram` for the given time in
+        seconds, as if `analyze()` had been called for that frame.
+        """
+        if self.spectrogram is None:
+            raise AudioAnalyzeError("No spectrogram available")
+            return 1
+        row = int(round(time*self.spectrogram_fps))
+        if row < 0 or row >= len(self.spectrogram):
+            raise AudioAnalyzeError("Time is beyond end of data")
+            return 2
+        self.freq_powers = numpy.array(
+            self.spectrogram[row], dtype=numpy.float64
+        )
+        self.fft_size = self.spectrogram_fft_size \
+            or 2*(len(self.freq_powers)-1)
         return 0
     
     
@@ -88,7 +1815,7 @@ class AudioAnalyze:
             return 0
         if not (min_key or max_key):
             return None
-        val = sum(self.freq_powers[min_key:max_key])
+        val = numpy.sum(self.freq_powers[min_key:max_key])
         if average:
             val /= max_key-min_key+1
         return val
@@ -114,62 +1841,135 @@ class AudioAnalyze:
         Gives powers for given frequency bins. `bins` is a list of tuples with
         minimum and maximum values of frequency ranges.
         """
-        out = []
-        for bin_min, bin_max in bins:
-            out.append(
-                (
-                    (bin_min, bin_max),
-                    self.freq_range_power(bin_min, bin_max, average)
-                )
-            )
+        powers = self.freq_bin_powers(bins, 'mean' if average else 'sum')
+        out = list(zip(bins, powers.tolist()))
         if sort:
             out.sort(key=lambda x:x[1])
         return out
     
     
+    def freq_bin_powers(self, bins, mode='mean'):
+        """
+        Like `list_freq_bin_powers()`, but returns an array with only the
+        powers. The key ranges of the bins are calculated once and then
+        reused for every spectrum of the same size (see `BinLayout`).
+        
+        Arguments:
+        bins    List of `(min_freq, max_freq)` tuples
+        mode    'sum', 'mean' or 'max'
+        """
+        return self.bin_layout(bins).aggregate(self.freq_powers, mode)
+    
+    
+    def filterbank_powers(self, num=20, min_freq=200, max_freq=20000,
+        scale='log'):
+        """
+        Return the powers of `num` log or mel spaced bands as an array, using
+        a sparse triangular filterbank (see `filterbank()`).
+        """
+        return apply_filterbank(
+            filterbank(
+                num, min_freq, max_freq, self.fft_size, self.data_samplerate,
+                len(self.freq_powers), scale
+            ),
+            self.freq_powers
+        )
+    
+    
+    def bin_layout(self, bins):
+        """
+        Return the (cached) `BinLayout` of `bins` for the current spectrum.
+        """
+        key = (
+            tuple(bins), self.fft_size, self.data_samplerate,
+            len(self.freq_powers)
+        )
+        if not key in self.bin_layouts:
+            self.bin_layouts[key] = BinLayout(
+                bins, self.fft_size, self.data_samplerate,
+                len(self.freq_powers)
+            )
+        return self.bin_layouts[key]
+    
+    
+    def peaks(self, k=5, min_freq=None, max_freq=None):
+        """
+        Return the `k` strongest peaks in the given frequency range as a list
+        of tuples (frequency Hz, power), strongest first. The frequencies are
+        interpolated between keys (see `find_peaks()`). Follow them across
+        frames with a `PeakTracker`.
+        """
+        keys, powers = find_peaks(
+            self.freq_powers, k,
+            self.freq_to_key(min_freq) or 0,
+            self.freq_to_key(max_freq) or len(self.freq_powers)
+        )
+        freqs = keys*(float(self.data_samplerate)/self.fft_size)
+        return zip(freqs.tolist(), powers.tolist())
+    
+    
     def dominant_freq(self, min_freq=None, max_freq=None):
         """
         Find the frequency with the most power in the given range; return a
-        tuple with it's frequency and power.
+        tuple with it's frequency and power (or None if the range is empty).
         """
-        freqs = self.list_freq_powers(min_freq, max_freq, sort=True)
-        return freqs[len(freqs)-1]
+        peaks = self.peaks(1, min_freq, max_freq)
+        if not peaks:
+            return None
+        return peaks[0]
         
         
-    def normalize(self, average=False, history=25*5):
+    def normalize(self, average=False, history=25*5, mode=None):
         """
         Normalize the frequency powers, so the all values from 0 - 1 are nicely
         used.
         
         Peak method: The loudest frequency has a value of 1.0
         Average method: The average of all frequencies is 1.0
+        Percentile method: see `Normalizer`
         
         Arguments:
         average        If false, peak mode is used, otherwise average
+        history        How many past frames to consider
+        mode           'peak', 'average' or 'percentile'; overrides `average`
         
         """
-        if average: # average method
-            total_power = sum(self.freq_powers)/len(self.freq_powers)
-        else: # peak method
-            total_power = max(self.freq_powers)
-        self.max_powers.append(total_power)
-        if len(self.max_powers) >= self.max_powers_len:
-            del self.max_powers[0]
-        powers = numpy.array(self.max_powers[-history:])
-        max_power = max( powers * numpy.linspace(
-                    start=1.0/history,
-                    stop=1.0,
-                    num=len(powers)
-                )
-            )
-        nv = 1.0/max_power
-        for i, freq in enumerate(self.freq_powers):
-            self.freq_powers[i] *= nv
+        if not mode:
+            mode = 'average' if average else 'peak'
+        if not self.normalizer or self.normalizer.mode != mode \
+                or self.normalizer.history != history:
+            self.normalizer = Normalizer(history, mode)
+        self.normalizer.normalize(self.freq_powers)
+        return 0
+    
+    
+    def reset_normalization(self):
+        """
+        Forget the past frames that `normalize()` considers.
+        """
+        if self.normalizer:
+            self.normalizer.reset()
         return 0
     
     
-    def reset_normalization():
-        self.max_powers = []
+    def get_state(self):
+        """
+        Return what the analysis keeps from frame to frame (the normalization
+        history) as a dictionary that can be pickled, e.g. for a checkpoint.
+        """
+        return {
+            'normalizer' :
+                self.normalizer.get_state() if self.normalizer else None,
+        }
+    
+    
+    def set_state(self, state):
+        """
+        Restore a state returned by `get_state()`.
+        """
+        self.normalizer = None
+        if state['normalizer']:
+            self.normalizer = Normalizer.from_state(state['normalizer'])
         return 0
     
     # Helper functions for unit conversions
@@ -178,10 +1978,16 @@ class AudioAnalyze:
         """
         Given a frequency, returns the key of the item in the `freq_powers` 
         arrays that contains that frequencys value.
+        
+        Keys are `data_samplerate/fft_size` Hz apart. This used to be derived
+        from `len(data)`, which was only right when the transform was as long
+        as the samples: welch transformed 256 sample segments, transforms are
+        now padded to fast sizes, and spectra from a spectrogram or another
+        process come without any samples.
         """
         if not freq:
             return None # useful for shorthand use of this function
-        key = int(float(freq)/self.data_samplerate*len(self.data))
+        key = int(float(freq)/self.data_samplerate*self.fft_size)
         if key >= len(self.freq_powers) or key < 0:
             return None
         return key
@@ -189,9 +1995,10 @@ class AudioAnalyze:
     
     def key_to_freq(self, key):
         """
-        Given a key in `freq_power`, return the frequency of that key in Hz.
+        Given a key in `freq_power`, return the frequency of that key in Hz
+        (see `freq_to_key()`).
         """
-        return int(key/(len(self.data)*(1.0/self.data_samplerate)))
+        return int(key/(self.fft_size*(1.0/self.data_samplerate)))
     
     
     def octave_to_freq(self, base_freq=1, octave=0):
@@ -211,12 +2018,17 @@ class AudioAnalyze:
     def linear_bins(self, start=0, stop=1, num=0):
         """
         Generates an array of linearly evenly spaced bins. Every bin is a tuple
-        containing two values: The beginning and the end of the bin.
+        containing two values: The beginning and the end of the bin. The
+        returned list is cached and must not be modified.
         """
+        key = ('linear', start, stop, num)
+        if key in self.bin_lists:
+            return self.bin_lists[key]
         out = []
         inc = (stop-start)/float(num)
         for i in range(0, num):
             out.append((i*inc+start, (i+1)*inc+start))
+        self.bin_lists[key] = out
         return out
     
     
@@ -225,6 +2037,9 @@ class AudioAnalyze:
         Like `linear_bins()`, but uses logarithmic scale. Base 2 works well for
         frequencies, because human hearing uses octaves.
         """
+        key = ('logarithmic', start, stop, num, base)
+        if key in self.bin_lists:
+            return self.bin_lists[key]
         out = []
         factor = math.log((stop-start),base)/num
         
@@ -232,6 +2047,7 @@ class AudioAnalyze:
             out.append(
                 (base**(i*factor)+start-1, base**((i+1)*factor)+start)
             )
+        self.bin_lists[key] = out
         return out
     
     
@@ -250,17 +2066,21 @@ class AudioAnalyze:
         Map a value on a logarithmic function. The input value lies between
         `in_min` and `in_max`. The logarithmic function is described by `base`,
         and a "window" of `log_min` and `log_max` (these are the X values on the
-        logarithmic function).
+        logarithmic function). `val` can also be a NumPy array.
         """
         if not out_min and not out_max:
             out_min = log_min
             out_max = log_max
         val = (val-in_min)/float(in_max-in_min)
-        return self.linear_scale(
-            math.log(
+        if isinstance(val, numpy.ndarray):
+            log = numpy.log((log_max-log_min)*val+log_min)/math.log(base)
+        else:
+            log = math.log(
                 (log_max-log_min)*val+log_min, 
                 base
-            ),
+            )
+        return self.linear_scale(
+            log,
             math.log(log_min, base), math.log(log_max, base), out_min, out_max
         )
     
@@ -268,37 +2088,42 @@ class AudioAnalyze:
     def A_weighting(self, val, freq):
         """
         Return an A-weighted value of the power of a given frequency.
-        Gain function according to Wikipedia.
-        """
-        gain = (
-            (12200**2 * freq**4)
-            / (
-                (freq**2 + 20.6**2) * 
-                math.sqrt( (freq**2 + 107.7**2) * (freq**2 + 737.9**2) ) *
-                (freq**2 + 12200**2)
-            )
-        )
-        return val * gain**2
+        Gain function according to Wikipedia (see `A_weighting_gain()`).
+        """
+        return val * float(A_weighting_gain(freq))**2
     
     
     # WAV audio file handling
     
     def wave_open(self, wavefile):
         """
-        Open any file like object as an instance of `wave` for this class.
-        Only unsigned 8-bit and signed 16-bit WAV files are supported.
+        Open a WAV file for this class. File paths are memory-mapped (see
+        `WaveMap`), any other file like object is read in chunks (see
+        `WaveStream`). Unsigned 8-bit and signed 16, 24 and 32-bit PCM WAV
+        files are supported, as well as 32-bit float files, extensible
+        formats and RF64 files.
 
         Arguments:
         wavefile        File path or file like object
         """
-        self.file_ = wave.open( wavefile )
-        self.data_nchannels, self.data_sampwidth, self.data_framerate, \
-        self.data_nframes, no, no = self.file_.getparams()
-        if self.data_sampwidth > 2:
-            self.file_.close()
-            self.file_ = None
-            raise AudioAnalyzeError("Unsupported WAV file")
-            return 1
+        self.file_ = None
+        self.map_ = None
+        self.pos = 0
+        if isinstance(wavefile, basestring):
+            self.map_ = WaveMap(wavefile)
+            self.data_nchannels = self.map_.nchannels
+            self.data_sampwidth = self.map_.sampwidth
+            self.data_framerate = self.map_.framerate
+            self.data_nframes = self.map_.nframes
+            self.data_float = self.map_.float_format
+            self.data_samplerate = self.data_framerate
+            return 0
+        self.file_ = WaveStream(wavefile)
+        self.data_nchannels = self.file_.nchannels
+        self.data_sampwidth = self.file_.sampwidth
+        self.data_framerate = self.file_.framerate
+        self.data_nframes = self.file_.nframes
+        self.data_float = self.file_.float_format
         self.data_samplerate = self.data_framerate
         return 0
     
@@ -310,22 +2135,43 @@ class AudioAnalyze:
         Arguments:
         time        Time in seconds to move to
         """
-        if not self.file_:
+        return self.wave_setpos(int(time*self.data_framerate))
+    
+    
+    def wave_setpos(self, pos=0):
+        """
+        Move in the file to the given frame.
+        """
+        if not self.file_ and not self.map_:
             return 1
-        goto = int(time*self.data_framerate)
-        if goto > self.data_nframes:
+        if pos > self.data_nframes:
             raise AudioAnalyzeError("Time is beyond end of data")
             return 2
-        self.file_.setpos(goto)
+        if self.map_:
+            self.pos = pos
+        else:
+            self.file_.setpos(pos)
         return 0
     
     
+    def wave_getpos(self):
+        """
+        Return the current position in the file in frames.
+        """
+        if self.map_:
+            return self.pos
+        elif self.file_:
+            return self.file_.getpos()
+        else:
+            return 0
+    
+    
     def wave_tell(self):
         """
         Return playback time.
         """
-        if self.file_:
-            return self.file_.tell()/float(self.data_framerate)
+        if self.data_framerate:
+            return self.wave_getpos()/float(self.data_framerate)
         else:
             return 0
         
@@ -352,51 +2198,53 @@ class AudioAnalyze:
             chunk_size = frames
         else:
             chunk_size = int(duration*self.data_framerate)
-        if self.file_.tell()+chunk_size > self.data_nframes:
+        if self.wave_getpos()+chunk_size > self.data_nframes:
             raise AudioAnalyzeError("Chunk size goes beyond end of data")
             return 1
-        raw_data = self.file_.readframes(chunk_size)
-        self.wave_parse(
-            raw_data,
-            self.data_sampwidth,
-            self.data_nchannels
-        )
+        if self.map_:
+            self.data = pcm_to_float(
+                self.map_.window(start=self.pos, frames=chunk_size),
+                self.downmix
+            )
+            self.pos += chunk_size
+            return 0
+        self.file_.downmix = self.downmix
+        self.data = self.file_.read(chunk_size)
         return 0
     
     
-    def wave_parse(self, raw_data=None, sampwidth=1, nchannels=1):
+    def wave_parse(self, raw_data=None, sampwidth=1, nchannels=1,
+        float_format=False, downmix=False):
         """
-        Parse some raw audio data.
+        Parse some raw audio data into `data` (a float32 array).
         
         Arguments:
         raw_data    Data to parse
         sampwidth   Sample width of the individual samples;
                     1 -> UInt8
                     2 -> SInt16
-        nchannels   Number of channels (Only first one will be parsed)
-        """
-        if sampwidth == 1:
-            fmt = '<B' # little-endian unsigned char
-            min_ = 0
-            max_ = 2**8
-        elif sampwidth == 2:
-            fmt = '<h' # little-endian signed short
-            min_ = -(2**16)/2
-            max_ = (2**16)/2
-        self.data = []
-        i = 0
-        while i<len(raw_data):
-            val = struct.unpack(
-                fmt, raw_data[i:i+sampwidth]
-            )[0]
-            self.data.append(2*((val+abs(min_))/float(max_-min_))-1) # -1.0-1.0
-            i += sampwidth*nchannels
-        if not raw_data:
+                    3 -> SInt24
+                    4 -> SInt32 (or Float32 if `float_format` is set)
+        nchannels   Number of channels
+        float_format Wether 4 byte samples are IEEE floats
+        downmix     Average all channels instead of using only the first one
+        """
+        if raw_data is None or not len(raw_data):
+            self.data = numpy.zeros(0, dtype=numpy.float32)
             return 1
+        self.data = pcm_to_float(
+            pcm_view(raw_data, sampwidth, nchannels, float_format),
+            downmix
+        )
+        return 0
     
     # Initialization
     
     def __init__(self, wavefile=None):
+        self.bin_layouts = {}
+        self.bin_lists = {}
+        self.constant_qs = {}
+        self.fft_backend = FFTBackend()
         if wavefile:
             self.wave_open(wavefile)
 
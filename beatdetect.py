@@ -0,0 +1,175 @@
+"""
+Detect onsets and estimate the tempo from a stream of spectra.
+
+`OnsetDetector.update()` is given the spectrum of every frame (e.g.
+`AudioAnalyze.freq_powers`) and compares it to the previous one. The positive
+changes of all frequencies add up to the spectral flux, which is kept in a
+ring buffer (the onset envelope). A frame is an onset if its flux is clearly
+above the recent average. The tempo is the strongest periodicity of the
+envelope.
+"""
+
+import numpy
+
+
+class OnsetDetector:
+    """
+    Attributes:
+    fps             Frames (spectra) per second
+    envelope        Ring buffer of the spectral flux of the past frames
+    pos             Position in `envelope` the next value is written to
+    threshold_len   Number of past frames the adaptive threshold averages
+    multiplier      Flux has to be this many times the average...
+    delta           plus this much to count as an onset
+    min_interval    Minimum number of frames between two onsets
+    compression     Spectra are compressed with `log(1+compression*power)`,
+                    so quiet frequencies count too
+    onset           Wether the last frame was an onset
+    flux            Spectral flux of the last frame
+    threshold       Threshold the last frame was compared to
+    """
+    
+    fps = 30.0
+    envelope = None
+    pos = 0
+    threshold_len = 15
+    multiplier = 1.5
+    delta = 0.0
+    min_interval = 3
+    compression = 1000.0
+    onset = False
+    flux = 0.0
+    threshold = 0.0
+    
+    
+    def __init__(self, fps=30.0, history=8.0, threshold_time=0.5,
+            multiplier=1.5, delta=0.0, min_interval=0.1, compression=1000.0):
+        """
+        Arguments:
+        fps             Frames per second
+        history         Seconds of onset envelope to keep (for the tempo)
+        threshold_time  Seconds the adaptive threshold averages over
+        multiplier, delta, compression
+                        See class attributes
+        min_interval    Minimum time between two onsets in seconds
+        """
+        self.fps = float(fps)
+        self.envelope = numpy.zeros(max(int(history*fps), 2))
+        self.threshold_len = min(
+            max(int(threshold_time*fps), 1), len(self.envelope)-1
+        )
+        self.multiplier = multiplier
+        self.delta = delta
+        self.min_interval = max(int(min_interval*fps), 1)
+        self.compression = compression
+        self.reset()
+    
+    
+    def update(self, powers):
+        """
+        Process the spectrum of the next frame. Returns True if it is an
+        onset.
+        """
+        if self._current is None or len(self._current) != len(powers):
+            self._current = numpy.zeros(len(powers))
+            self._previous = numpy.zeros(len(powers))
+            self._diff = numpy.empty(len(powers))
+        numpy.multiply(powers, self.compression, out=self._current)
+        numpy.log1p(self._current, out=self._current)
+        numpy.subtract(self._current, self._previous, out=self._diff)
+        numpy.maximum(self._diff, 0, out=self._diff)
+        self.flux = self._diff.sum()
+        self._previous, self._current = self._current, self._previous
+        # running sum over the last `threshold_len` values of the envelope
+        self.threshold = self.multiplier*self._sum/self.threshold_len \
+            + self.delta
+        self._sum += self.flux - self.envelope[
+            (self.pos-self.threshold_len)%len(self.envelope)
+        ]
+        self.envelope[self.pos] = self.flux
+        self.pos = (self.pos+1)%len(self.envelope)
+        if not self.pos: # get rid of accumulated rounding errors
+            self._sum = self.envelope[-self.threshold_len:].sum()
+        self._since_onset += 1
+        self.onset = self.flux > self.threshold \
+            and self._since_onset >= self.min_interval
+        if self.onset:
+            self._since_onset = 0
+        return self.onset
+    
+    
+    def tempo(self, min_bpm=60, max_bpm=180):
+        """
+        Estimate the tempo in beats per minute from the autocorrelation of
+        the onset envelope (calculated with an FFT). Returns 0 if the
+        envelope is too short for the given range.
+        """
+        n = len(self.envelope)
+        min_lag = max(int(60.0*self.fps/max_bpm), 1)
+        max_lag = min(int(60.0*self.fps/min_bpm)+1, n-1)
+        if min_lag >= max_lag:
+            return 0
+        envelope = numpy.roll(self.envelope, -self.pos) # oldest first
+        envelope -= envelope.mean()
+        spectrum = numpy.fft.rfft(envelope, 2*n) # padded: no wrap-around
+        correlation = numpy.fft.irfft(spectrum.real**2+spectrum.imag**2)[:n]
+        lag = min_lag+numpy.argmax(correlation[min_lag:max_lag])
+        if 0 < lag < n-1: # parabolic interpolation between lags
+            a, b, c = correlation[lag-1:lag+2]
+            if a-2*b+c != 0:
+                lag += 0.5*(a-c)/(a-2*b+c)
+        return 60.0*self.fps/lag
+    
+    
+    def reset(self):
+        """
+        Forget all past frames.
+        """
+        self.envelope[:] = 0
+        self.pos = 0
+        self.onset = False
+        self.flux = 0.0
+        self._sum = 0.0
+        self._since_onset = self.min_interval
+        self._current = None
+        self._previous = None
+        return 0
+    
+    
+    def get_state(self):
+        """
+        Return the onset envelope and what else is kept from frame to frame
+        as a dictionary that can be pickled.
+        """
+        return {
+            'envelope' : self.envelope.copy(),
+            'pos' : self.pos,
+            'onset' : self.onset,
+            'flux' : self.flux,
+            'threshold' : self.threshold,
+            'sum' : self._sum,
+            'since_onset' : self._since_onset,
+            'previous' : None if self._previous is None
+                else self._previous.copy(),
+        }
+    
+    
+    def set_state(self, state):
+        """
+        Restore a state returned by `get_state()` (of a detector with the same
+        settings).
+        """
+        self.envelope[:] = state['envelope']
+        self.pos = state['pos']
+        self.onset = state['onset']
+        self.flux = state['flux']
+        self.threshold = state['threshold']
+        self._sum = state['sum']
+        self._since_onset = state['since_onset']
+        self._current = None
+        self._previous = None
+        if state['previous'] is not None:
+            self._current = numpy.zeros(len(state['previous']))
+            self._previous = state['previous'].copy()
+            self._diff = numpy.empty(len(state['previous']))
+        return 0
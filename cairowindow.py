@@ -7,23 +7,36 @@ initialize the SDL window and SDL renderer yourself and assign them to
 `cairoWindow.sdlWindow` and `cairoWindow.sdlRenderer` respectively. You can 
 then still use `cairoWindow.refresh()` to copy the contents of the cairo
 surface to the window.
+
+The window keeps one streaming texture in the format of the cairo surface and
+updates it in place every frame; it is only recreated when the size of the
+cairo surface changes.
 """
 
+import time
 from ctypes import c_byte
 import cairo
 import sdl2
 
+import timemanager
+
 
 class CairoWindow:
     
     cairo_surface = None
     sdl_window = None
     sdl_renderer = None
+    sdl_texture = None
+    texture_size = None
+    _texture_surface = None
+    _pixels = None
     
     loop_running = False
     loop_iteration = 0
     loop_events = []
     loop_sleep = 1.0/30
+    fps = None # pace `loop()` with a `FrameScheduler` instead of sleeping
+    scheduler = None
     
     
     def open(self, cairo_surface=None, title="Cairo", position=(0,0), flags=0):
@@ -64,7 +77,14 @@ class CairoWindow:
                 -1,
                 sdl2.SDL_RENDERER_ACCELERATED
             )
-        
+            if not self.sdl_renderer:
+                # e.g. SDL_VIDEODRIVER=dummy has no accelerated renderer
+                self.sdl_renderer = sdl2.SDL_CreateRenderer(
+                    self.sdl_window,
+                    -1,
+                    sdl2.SDL_RENDERER_SOFTWARE
+                )
+
         sdl2.SDL_ShowWindow( self.sdl_window )
         self.refresh()
         
@@ -75,6 +95,9 @@ class CairoWindow:
         """
         Close the window and free memory.
         """
+        if self.sdl_texture:
+            sdl2.SDL_DestroyTexture( self.sdl_texture )
+            self.sdl_texture = None
         sdl2.SDL_DestroyWindow( self.sdl_window )
         sdl2.SDL_DestroyRenderer( self.sdl_renderer )
         sdl2.SDL_Quit()
@@ -98,26 +121,52 @@ class CairoWindow:
         if not self.cairo_surface.get_format() in (cairo.FORMAT_ARGB32, 
                 cairo.FORMAT_RGB24):
             return 3
+        size = (
+            self.cairo_surface.get_width(), self.cairo_surface.get_height()
+        )
+        if not self.sdl_texture or self.texture_size != size \
+                or self._texture_surface is not self.cairo_surface:
+            self.create_texture()
         self.cairo_surface.flush()
-        pixel_data = self.cairo_surface.get_data()
-        pixel_data_array = (c_byte*len(pixel_data)).from_buffer(pixel_data)
-        surface = sdl2.SDL_CreateRGBSurfaceFrom(
-            pixel_data_array,
-            self.cairo_surface.get_width(),
-            self.cairo_surface.get_height(),
-            32, # RGB24 leaves upper 8 bits unused
-            self.cairo_surface.get_stride(),
-            0x00ff0000,
-            0x0000ff00,
-            0x000000ff,
-            0x00000000 # No support for alpha right now!
+        sdl2.SDL_UpdateTexture(
+            self.sdl_texture,
+            None,
+            self._pixels,
+            self.cairo_surface.get_stride()
         )
-        texture = sdl2.SDL_CreateTextureFromSurface(self.sdl_renderer, surface)
-        sdl2.SDL_FreeSurface(surface)
         sdl2.SDL_RenderClear(self.sdl_renderer)
-        sdl2.SDL_RenderCopy(self.sdl_renderer, texture, None, None)
+        sdl2.SDL_RenderCopy(self.sdl_renderer, self.sdl_texture, None, None)
         sdl2.SDL_RenderPresent(self.sdl_renderer)
-        sdl2.SDL_DestroyTexture(texture)
+        return 0
+    
+    
+    def create_texture(self):
+        """
+        (Re)create the streaming texture that `refresh()` copies the cairo
+        surface to, in the size of the cairo surface.
+        
+        Returns:
+        0       Success
+        """
+        if self.sdl_texture:
+            sdl2.SDL_DestroyTexture(self.sdl_texture)
+        width = self.cairo_surface.get_width()
+        height = self.cairo_surface.get_height()
+        self.sdl_texture = sdl2.SDL_CreateTexture(
+            self.sdl_renderer,
+            # cairo's 32 bit native endian 0xAARRGGBB pixels; the upper 8 bits
+            # are ignored (unused in RGB24, no support for alpha right now!)
+            sdl2.SDL_PIXELFORMAT_RGB888,
+            sdl2.SDL_TEXTUREACCESS_STREAMING,
+            width,
+            height
+        )
+        self.texture_size = (width, height)
+        # the pixel data of an image surface doesn't move, so one view of it
+        # is enough
+        pixel_data = self.cairo_surface.get_data()
+        self._pixels = (c_byte*len(pixel_data)).from_buffer(pixel_data)
+        self._texture_surface = self.cairo_surface
         return 0
     
     
@@ -126,8 +175,10 @@ class CairoWindow:
         A simple main loop that keeps the window open for the time specified
         and executes given callbacks.
         
+        If `fps` is set, frames are paced by a `FrameScheduler`, otherwise
+        the loop sleeps `loop_sleep` seconds between frames.
+        
         Arguments:
-        sleep       How long to sleep betweeen frames in seconds.
         callbacks   List of functions to execute every frame. Arguments:
                     1. `i` - The callback has been executed this many times
                     2. `events` - List of new `SDL_Event` structs
@@ -139,6 +190,9 @@ class CairoWindow:
         """
         self.loop_running = True
         i = 0
+        if self.fps:
+            self.scheduler = FrameScheduler(self.fps)
+            self.scheduler.start()
         while self.loop_running:
             self.loop_iteration = i
             self.loop_events = []
@@ -149,9 +203,13 @@ class CairoWindow:
                     self.loop_running = False
             for callback in callbacks:
                 callback()
-            if self.loop_sleep > 0:
-                sdl2.SDL_Delay(int(self.loop_sleep*1000))
-            self.refresh()
+            if self.scheduler:
+                self.refresh()
+                self.scheduler.wait()
+            else:
+                if self.loop_sleep > 0:
+                    sdl2.SDL_Delay(int(self.loop_sleep*1000))
+                self.refresh()
             i += 1
         self.close()
         return 0
@@ -163,4 +221,102 @@ class CairoWindow:
         constructor as a shortcut for `open()`. Arguments are the same.
         """
         self.open( *args, **kwargs )
-        
\ No newline at end of file
+
+
+class FrameScheduler:
+    """
+    Paces a loop to a target frame rate. Every frame has a deadline, one
+    frame period after the last one; `wait()` sleeps until it. A frame that
+    finishes after its deadline is late. If frames fall behind by whole
+    periods, the scheduler either drops those deadlines and continues on the
+    next one (`drop`), or runs the following frames without sleeping until
+    it has caught up, starting over from now if that's more than
+    `max_catch_up` frames.
+    
+    Attributes:
+    fps             Target frames per second
+    period          Time per frame in seconds
+    drop            Wether to drop missed deadlines instead of catching up
+    max_catch_up    Maximum number of frames to catch up
+    deadline        Deadline of the current frame (`timemanager.monotonic()`)
+    lateness        Seconds the last frame was late (negative: early)
+    max_lateness    Largest lateness so far
+    frames          Number of frames so far
+    late_frames     Number of frames that missed their deadline
+    dropped_frames  Number of deadlines dropped
+    """
+    
+    fps = 30.0
+    period = 1.0/30
+    drop = True
+    max_catch_up = 3
+    deadline = 0
+    lateness = 0.0
+    max_lateness = 0.0
+    total_lateness = 0.0
+    frames = 0
+    late_frames = 0
+    dropped_frames = 0
+    
+    
+    def __init__(self, fps=30.0, drop=True, max_catch_up=3):
+        self.fps = float(fps)
+        self.period = 1.0/self.fps
+        self.drop = drop
+        self.max_catch_up = max_catch_up
+    
+    
+    def start(self):
+        """
+        Set the first deadline one period from now and reset the statistics.
+        """
+        self.deadline = timemanager.monotonic()+self.period
+        self.lateness = 0.0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+        self.frames = 0
+        self.late_frames = 0
+        self.dropped_frames = 0
+        return 0
+    
+    
+    def wait(self):
+        """
+        Call when a frame is done: record its lateness, sleep until its
+        deadline and move on to the next one. Returns the number of dropped
+        deadlines.
+        """
+        now = timemanager.monotonic()
+        self.lateness = now-self.deadline
+        self.frames += 1
+        self.total_lateness += max(self.lateness, 0)
+        self.max_lateness = max(self.max_lateness, self.lateness)
+        if self.lateness <= 0:
+            time.sleep(-self.lateness)
+            self.deadline += self.period
+            return 0
+        self.late_frames += 1
+        behind = int(self.lateness/self.period)
+        if self.drop:
+            self.dropped_frames += behind
+            self.deadline += (behind+1)*self.period
+            return behind
+        if behind > self.max_catch_up:
+            self.deadline = now+self.period # start over
+        else:
+            self.deadline += self.period
+        return 0
+    
+    
+    def stats(self):
+        """
+        Return a dictionary with the frame count, late and dropped frames,
+        and the mean and maximum lateness in seconds.
+        """
+        return {
+            'frames' : self.frames,
+            'late' : self.late_frames,
+            'dropped' : self.dropped_frames,
+            'mean_lateness' : self.total_lateness/max(self.frames, 1),
+            'max_lateness' : self.max_lateness,
+        }
@@ -39,7 +39,7 @@ class CircleVisualizer(visualizer.Visualizer):
         for circle_i in range(0, self.num_circles):
             circle_i = self.num_circles-1-circle_i
             num_subsections = self.num_subsections**(circle_i+1)
-            powers = self.a.list_freq_bin_powers(
+            powers = self.a.freq_bin_powers(
                 bins=self.a.logarithmic_bins(
                     start=self.min_freq, stop=self.max_freq,
                     num=num_subsections
@@ -47,7 +47,7 @@ class CircleVisualizer(visualizer.Visualizer):
             )
             for subsection_i in range(0, num_subsections):
                 val = helpers.logarithmic(
-                    powers[subsection_i][1],
+                    powers[subsection_i],
                     base=self.freq_base
                 )
                 max_val_t = self.t.tell()\
@@ -23,19 +23,24 @@ class EqualizerVisualizer(visualizer.Visualizer):
         ] * self.freq_num
         self.max_decay = 1
         self.duration = 2
+        self.add_static_layer('background', self.draw_background)
+    
+    def draw_background(self, context, width, height):
+        context.set_source(self.color_bg_1)
+        context.paint()
+        context.set_source(self.color_bg_2)
+        context.rectangle(0, 0, width, 100)
+        context.fill()
+        return
     
     def draw(self):
         
         #freq_crop = int(self.p[0]*10)
         freq_crop = 0
         
-        self.c.set_source(self.color_bg_1)
-        self.c.paint()
-        self.c.set_source(self.color_bg_2)
-        self.c.rectangle(0, 0, self.w, 100)
-        self.c.fill()
+        self.paint_static_layer('background')
         
-        powers = self.a.list_freq_bin_powers(
+        powers = self.a.freq_bin_powers(
             self.a.logarithmic_bins(
                 start=self.freq_min,
                 stop=self.freq_max,
@@ -47,8 +52,10 @@ class EqualizerVisualizer(visualizer.Visualizer):
         average = self.a.freq_range_power(average=True)
         
         # freq bars
-        for i, freq in enumerate(powers):
-            power = self.a.logarithmic_scale(freq[1], log_min=0.1, log_max=10)
+        for i, freq_power in enumerate(powers):
+            power = self.a.logarithmic_scale(
+                freq_power, log_min=0.1, log_max=10
+            )
             max_power_t = self.t.tell()-self.max_powers[i][1]
             max_power = (1-helpers.accel_decel(max_power_t, self.duration))\
                 *self.max_powers[i][0]
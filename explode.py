@@ -2,10 +2,13 @@
 Explode Visualisation
 """
 
+import math
+import numpy
 import cairo
 import visualizer
 import animation
 import helpers
+import raster
 
 class ExplodeVisualizer(visualizer.Visualizer):
     
@@ -15,7 +18,43 @@ class ExplodeVisualizer(visualizer.Visualizer):
         self.freq_steps = 200
         self.pixel_height = 7
         self.y_resolution = 1
-        self.pixels = [[(0,0.0)] * self.freq_steps] * int((self.h/2)/self.pixel_height*self.y_resolution)
+        self.pixels = numpy.zeros((
+            int((self.h/2)/self.pixel_height*self.y_resolution),
+            self.freq_steps
+        ))
+        self.raster = None
+        self.layout_rows()
+        return
+    
+    
+    def layout_rows(self):
+        """
+        Work out which row of `self.pixels` shows on every line of pixels
+        from the top down to the bottom of the newest row, and how much it is
+        faded there. Older rows move up faster and are drawn over the newer
+        ones; lines between rows stay black.
+        """
+        num_rows = (self.h/2)/self.pixel_height # TODO rename this var
+        
+        start_v = 0.5
+        accel = 2 * (1 - start_v)
+        
+        lines = int(math.ceil(self.h/2 + self.pixel_height))
+        centers = numpy.arange(lines) + 0.5
+        self.line_rows = numpy.zeros(lines, dtype=numpy.intp)
+        self.line_factors = numpy.zeros(lines)
+        for row_i in range(len(self.pixels)):
+            fac = 1-(float(row_i*(1.0/self.y_resolution)) / (float(self.h/2)/self.pixel_height))
+            if row_i > 2:
+                fac *= 0.75
+            else:
+                fac = 1
+            t = ((float(row_i*(1.0/self.y_resolution)))/num_rows)
+            disp = start_v * t + 0.5 * accel * (t**2)
+            y = self.h/2 - disp*(self.h/2)
+            covered = (centers >= y) & (centers < y + self.pixel_height)
+            self.line_rows[covered] = row_i
+            self.line_factors[covered] = fac
         return
         
     def draw(self):
@@ -43,7 +82,7 @@ class ExplodeVisualizer(visualizer.Visualizer):
             )
         ]'''
         
-        powers = self.a.list_freq_powers()
+        powers = self.a.freq_powers[:-1] # as in list_freq_powers()
         '''powers = [
             x[1] for x in self.a.list_freq_powers()
         ]'''       
@@ -51,45 +90,26 @@ class ExplodeVisualizer(visualizer.Visualizer):
             #print powers[10]
             self.freq_steps = len(powers)
         
-        self.pixels.pop()
-        self.pixels.insert(0, powers)
+        if self.pixels.shape[1] != len(powers):
+            self.pixels = numpy.zeros((len(self.pixels), len(powers)))
+            self.raster = None
+        self.pixels[1:] = self.pixels[:-1]
+        self.pixels[0] = powers
         
-        num_rows = (self.h/2)/self.pixel_height # TODO rename this var
-        
-        start_v = 0.5
-        accel = 2 * (1 - start_v)
-            
         bg = cairo.SolidPattern(0, 0, 0)
         #self.c.rectangle(0, 0, self.w, self.h)
         self.c.set_source(bg)
         self.c.paint() 
-            
-        for row_i, row_pixels in enumerate(self.pixels):
-            for pixel_i, pixel in enumerate(row_pixels):
-                pixel = pixel[1]
-                fac = 1-(float(row_i*(1.0/self.y_resolution)) / (float(self.h/2)/self.pixel_height))
-                if row_i > 2:
-                    fac *= 0.75
-                else:
-                    fac = 1
-                color = cairo.SolidPattern(
-                    fac*pixel, fac*pixel, fac*pixel, 1.0
-                )
-                t = ((float(row_i*(1.0/self.y_resolution)))/num_rows)
-                disp = start_v * t + 0.5 * accel * (t**2)
-                
-                w = self.w/2.0/self.freq_steps
-                h = self.pixel_height
-                x = pixel_i * w
-                y = self.h/2 - disp*(self.h/2)
-                self.c.rectangle(x, y, w, h)
-                # mirror
-                '''self.c.rectangle(x, self.h-y-h, w, h)
-                self.c.rectangle(self.w-x-w, y, w, h)
-                self.c.rectangle(self.w-x-w, self.h-y-h, w, h)'''
-                self.c.set_source(color)
-                self.c.fill()
-                
-        return
         
-        
\ No newline at end of file
+        # one pixel per frequency and line, scaled to the cells' width
+        if self.raster is None:
+            self.raster = raster.Raster(len(powers), len(self.line_rows))
+        self.raster.set_intensities(
+            self.pixels, self.line_factors, self.line_rows
+        )
+        self.raster.paint(
+            self.c, 0, 0, self.w/2.0/self.freq_steps*len(powers),
+            len(self.line_rows)
+        )
+        
+        return
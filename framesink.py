@@ -0,0 +1,299 @@
+"""
+Write rendered frames somewhere.
+
+`Main.render()` hands every finished cairo surface to a frame sink:
+`PNGSink`       One PNG file per frame in a directory (slow: compression)
+`RawSink`       Raw BGRA pixels (cairo's ARGB32 in memory on little endian
+                machines), frame after frame, to a file or to stdout ('-'),
+                e.g. for `ffmpeg -f rawvideo -pix_fmt bgra -s WxH -i -`
+`Y4MSink`       YUV4MPEG2 (4:2:0, full range) to a file or to stdout
+`MemmapSink`    A preallocated `.npy` array of shape `(frames, height, width,
+                4)` that is written through a memory map
+Frames are numbered from 0. Sinks with a fixed frame size write every frame
+at its own offset, so they don't depend on the order the frames come in, and
+several processes can write to the same file: one creates the sink, the
+others open it with `create=False`.
+"""
+
+import os
+import sys
+import numpy
+
+
+def surface_pixels(surface):
+    """
+    Return a `(height, width, 4)` uint8 view of the BGRA pixels of a cairo
+    image surface (without the padding at the end of the rows).
+    """
+    surface.flush()
+    width = surface.get_width()
+    height = surface.get_height()
+    rows = numpy.frombuffer(surface.get_data(), dtype=numpy.uint8)\
+        .reshape(height, surface.get_stride())
+    return rows[:, :width*4].reshape(height, width, 4)
+
+
+class FrameSink:
+    """
+    Base class of the sinks.
+    
+    Attributes:
+    path        Where the frames go
+    width       Width of the frames in pixels
+    height      Height of the frames in pixels
+    fps         Frames per second
+    frames      Number of frames (0 if unknown; needed by `MemmapSink`)
+    create      Wether the sink was created or an existing one opened
+    """
+    
+    path = None
+    width = 0
+    height = 0
+    fps = 30
+    frames = 0
+    create = True
+    
+    
+    def __init__(self, path, width, height, fps=30, frames=0, create=True):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.frames = frames
+        self.create = create
+    
+    
+    def write(self, surface, index):
+        """
+        Write the contents of `surface` as frame number `index`.
+        """
+        raise NotImplementedError()
+    
+    
+    def existing_frames(self):
+        """
+        Return the number of complete frames from frame 0 on that are already
+        there (e.g. from an interrupted render), or None if the sink can't
+        tell.
+        """
+        return None
+    
+    
+    def flush(self):
+        """
+        Make sure the frames written so far are stored.
+        """
+        return 0
+    
+    
+    def close(self):
+        return 0
+
+
+class PNGSink(FrameSink):
+    """
+    Write `00001.png`, `00002.png`, ... (numbered from 1) to the directory
+    `path`.
+    """
+    
+    def write(self, surface, index):
+        surface.write_to_png(self.filename(index))
+        return 0
+    
+    
+    def filename(self, index):
+        return "{0:s}/{1:05d}.png".format(self.path, index+1)
+    
+    
+    def existing_frames(self):
+        index = 0
+        while os.path.exists(self.filename(index)):
+            index += 1
+        return index
+
+
+class StreamSink(FrameSink):
+    """
+    Base class of the sinks that write a stream of fixed size frames after a
+    fixed size header to a file or to stdout ('-'). Files are written at the
+    offset of every frame; stdout has to get the frames in order. Existing
+    files are opened without truncating them if `create` is False.
+    """
+    
+    header = ''
+    frame_header = ''
+    frame_size = 0
+    
+    
+    def __init__(self, path, width, height, fps=30, frames=0, create=True):
+        FrameSink.__init__(self, path, width, height, fps, frames, create)
+        if path == '-':
+            self._file = sys.__stdout__ # even if messages go elsewhere
+            self._seekable = False
+        else:
+            self._file = open(path, 'wb' if create else 'r+b')
+            self._seekable = True
+        if create:
+            self._file.write(self.header)
+        self._next = 0
+    
+    
+    def write(self, surface, index):
+        if self._seekable:
+            self._file.seek(
+                len(self.header)
+                + index*(len(self.frame_header)+self.frame_size)
+            )
+        elif index != self._next:
+            raise IOError("Frames written out of order to a stream")
+        self._file.write(self.frame_header)
+        self._file.write(self.convert(surface_pixels(surface)))
+        self._next = index+1
+        return 0
+    
+    
+    def convert(self, pixels):
+        """
+        Return the bytes to write for a `(height, width, 4)` BGRA frame.
+        """
+        raise NotImplementedError()
+    
+    
+    def existing_frames(self):
+        if not self._seekable:
+            return None
+        self._file.flush()
+        size = os.path.getsize(self.path)-len(self.header)
+        return max(size//(len(self.frame_header)+self.frame_size), 0)
+    
+    
+    def flush(self):
+        self._file.flush()
+        if self._seekable:
+            os.fsync(self._file.fileno())
+        return 0
+    
+    
+    def close(self):
+        self._file.flush()
+        if self._seekable: # not stdout
+            self._file.close()
+        return 0
+
+
+class RawSink(StreamSink):
+    """
+    Raw BGRA frames without any header.
+    """
+    
+    def __init__(self, path, width, height, fps=30, frames=0, create=True):
+        self.frame_size = width*height*4
+        StreamSink.__init__(self, path, width, height, fps, frames, create)
+    
+    
+    def convert(self, pixels):
+        return numpy.ascontiguousarray(pixels).tostring()
+
+
+class Y4MSink(StreamSink):
+    """
+    YUV4MPEG2 with 4:2:0 chroma subsampling and full range (JPEG) BT.601
+    colors. Odd frame sizes are padded by repeating the last row or column.
+    """
+    
+    def __init__(self, path, width, height, fps=30, frames=0, create=True):
+        self._padded = (width+width%2, height+height%2)
+        # C420jpeg only describes where the chroma samples sit; without
+        # XCOLORRANGE=FULL readers take the values as limited range
+        self.header = "YUV4MPEG2 W{0:d} H{1:d} F{2:d}:1 Ip A1:1 C420jpeg"\
+            " XCOLORRANGE=FULL\n"\
+            .format(self._padded[0], self._padded[1], int(fps))
+        self.frame_header = "FRAME\n"
+        self.frame_size = self._padded[0]*self._padded[1]*3//2
+        width, height = self._padded
+        self._rgb = numpy.empty((height, width, 3), dtype=numpy.float32)
+        self._yuv = numpy.empty(self.frame_size, dtype=numpy.uint8)
+        StreamSink.__init__(self, path, width, height, fps, frames, create)
+    
+    
+    def convert(self, pixels):
+        height, width = pixels.shape[:2]
+        rgb = self._rgb
+        rgb[:height, :width] = pixels[:, :, 2::-1] # BGRA to RGB
+        rgb[height:, :width] = rgb[height-1:height, :width]
+        rgb[:, width:] = rgb[:, width-1:width]
+        r, g, b = rgb[:, :, 0], rgb[:, :, 1], rgb[:, :, 2]
+        luma_size = rgb.shape[0]*rgb.shape[1]
+        chroma_size = luma_size//4
+        y = 0.299*r+0.587*g+0.114*b
+        # average every 2x2 block for the chroma planes
+        quads = rgb.reshape(
+            rgb.shape[0]//2, 2, rgb.shape[1]//2, 2, 3
+        ).mean(axis=(1, 3))
+        r, g, b = quads[:, :, 0], quads[:, :, 1], quads[:, :, 2]
+        u = 128-0.168736*r-0.331264*g+0.5*b
+        v = 128+0.5*r-0.418688*g-0.081312*b
+        for plane, start, size in ((y, 0, luma_size),
+                (u, luma_size, chroma_size),
+                (v, luma_size+chroma_size, chroma_size)):
+            numpy.clip(numpy.round(plane), 0, 255, out=plane)
+            self._yuv[start:start+size] = plane.ravel()
+        return self._yuv.tostring()
+
+
+class MemmapSink(FrameSink):
+    """
+    Write the BGRA frames into a `.npy` file of shape `(frames, height,
+    width, 4)`, which can be loaded with `numpy.load(path, mmap_mode='r')`.
+    The file is created with its full size up front; an existing file of the
+    same shape is written to instead (and has to exist if `create` is False).
+    """
+    
+    def __init__(self, path, width, height, fps=30, frames=0, create=True):
+        FrameSink.__init__(self, path, width, height, fps, frames, create)
+        if frames < 1:
+            raise ValueError("MemmapSink needs the number of frames")
+        shape = (frames, height, width, 4)
+        self.array = None
+        if os.path.exists(path):
+            self.array = numpy.lib.format.open_memmap(path, mode='r+')
+            if self.array.shape != shape or self.array.dtype != numpy.uint8:
+                self.array = None
+        if self.array is None:
+            if not create:
+                raise ValueError("No frame array of this shape to open")
+            self.array = numpy.lib.format.open_memmap(
+                path, mode='w+', dtype=numpy.uint8, shape=shape
+            )
+    
+    
+    def write(self, surface, index):
+        self.array[index] = surface_pixels(surface)
+        return 0
+    
+    
+    def flush(self):
+        self.array.flush()
+        return 0
+    
+    
+    def close(self):
+        self.array.flush()
+        return 0
+
+
+sinks = {
+    'png' : PNGSink,
+    'raw' : RawSink,
+    'y4m' : Y4MSink,
+    'npy' : MemmapSink,
+}
+
+
+def open_sink(kind, path, width, height, fps=30, frames=0, create=True):
+    """
+    Return a sink of the given kind (one of the keys of `sinks`).
+    """
+    if not kind in sinks:
+        raise ValueError("Unknown frame sink: {0:s}".format(kind))
+    return sinks[kind](path, width, height, fps, frames, create)
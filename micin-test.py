@@ -1,29 +1,32 @@
 #!/usr/bin/env python2.7
 
 import time
-import struct
 import pyaudio
 #import cairo
 #import sdl2
 #import cairowindow
+import audioanalyze
+import beatdetect
 
 pa = None
 
 class Main:
     stream = None
     samprate = 44100
+    buffer_length = 1024
 
-    prev = 0
+    analyzer = None
+    onsets = None
     i = 0
     def get_audio_callback(self):
         def callback(in_data, frame_count, time_info, status_flags):
-            threshold = 128/4
-            for d in in_data:
-                v = struct.unpack('B', d)[0]
-                if abs(v-self.prev) > threshold:
-                    print '{0: > 4d}. TAP'.format(self.i)
-                    self.i += 1
-                self.prev = v
+            self.analyzer.wave_parse(in_data, sampwidth=1, nchannels=1)
+            self.analyzer.analyze()
+            if self.onsets.update(self.analyzer.freq_powers):
+                print '{0: > 4d}. TAP ({1:.0f} BPM)'.format(
+                    self.i, self.onsets.tempo()
+                )
+                self.i += 1
             return None, pyaudio.paContinue
         return callback
     
@@ -37,10 +40,16 @@ class Main:
     
     def main(self):
         global pa
+        self.analyzer = audioanalyze.AudioAnalyze()
+        self.analyzer.data_samplerate = self.samprate
+        self.onsets = beatdetect.OnsetDetector(
+            self.samprate/float(self.buffer_length)
+        )
         pa = pyaudio.PyAudio()
         self.stream = \
             pa.open(rate=self.samprate,
             format=pyaudio.paUInt8,channels=1,input=True,
+            frames_per_buffer=self.buffer_length,
             stream_callback=self.get_audio_callback())
         self.loop()
         self.stream.stop_stream()
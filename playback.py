@@ -0,0 +1,246 @@
+"""
+Play WAV files through PyAudio.
+
+PyAudio calls the stream callback on its real-time thread, where anything
+slow causes an underrun (a gap in the sound). `Playback` decodes and converts
+the file on a thread of its own instead, a few blocks ahead of the callback,
+into a fixed set of preallocated buffers in the device's sample format. The
+callback only hands out the next converted buffer.
+"""
+
+import time
+import threading
+import Queue
+import numpy
+import pyaudio
+
+import audioanalyze
+
+
+sample_formats = {
+    'int16' : (numpy.int16, pyaudio.paInt16),
+    'float32' : (numpy.float32, pyaudio.paFloat32),
+}
+
+
+class Playback:
+    """
+    Attributes:
+    analyzer        `AudioAnalyze` the file is decoded with
+    samplerate      Samplerate of the file
+    block_size      Number of frames per buffer (and per stream callback)
+    prefetch        Number of buffers decoded ahead of the callback
+    sample_format   'int16' or 'float32' (see `sample_formats`)
+    pos             Position of the next frame the callback plays
+    paused          Wether the callback plays silence
+    underruns       Number of callbacks that found no decoded buffer
+    on_play         Function that is called with the position in seconds and
+                    PyAudio's `time_info` of every buffer handed to the
+                    device, e.g. `timemanager.TimeManager.sync_audio()`
+    """
+    
+    analyzer = None
+    samplerate = 0
+    block_size = 1024
+    prefetch = 4
+    sample_format = 'int16'
+    pos = 0
+    paused = False
+    underruns = 0
+    on_play = None
+    
+    
+    def __init__(self, wavefile, block_size=1024, prefetch=4,
+            sample_format='int16'):
+        """
+        Arguments:
+        wavefile        Path of the WAV file
+        block_size      Number of frames per buffer
+        prefetch        Number of buffers to decode ahead
+        sample_format   'int16' or 'float32'
+        """
+        if not sample_format in sample_formats:
+            raise audioanalyze.AudioAnalyzeError("Unknown sample format")
+        self.analyzer = audioanalyze.AudioAnalyze(wavefile)
+        self.samplerate = self.analyzer.data_samplerate
+        self.block_size = block_size
+        self.prefetch = prefetch
+        self.sample_format = sample_format
+        dtype = sample_formats[sample_format][0]
+        # one more buffer than prefetched: the one the device is playing
+        self._buffers = [
+            numpy.zeros(block_size, dtype=dtype) for i in range(prefetch+2)
+        ]
+        self._silence = numpy.zeros(block_size, dtype=dtype)
+        self._scratch = numpy.zeros(block_size, dtype=numpy.float32)
+        self._free = Queue.Queue()
+        self._filled = Queue.Queue()
+        for i in range(len(self._buffers)):
+            self._free.put(i)
+        self._playing = None
+        self._generation = 0
+        self._seek_to = 0
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+    
+    
+    def format(self):
+        """
+        Return the PyAudio sample format of the buffers.
+        """
+        return sample_formats[self.sample_format][1]
+    
+    
+    def start(self):
+        """
+        Start decoding ahead (before the stream starts).
+        """
+        if self._running:
+            return 1
+        self._running = True
+        self._thread = threading.Thread(target=self._decode)
+        self._thread.daemon = True
+        self._thread.start()
+        return 0
+    
+    
+    def stop(self):
+        """
+        Stop decoding.
+        """
+        if not self._running:
+            return 1
+        self._running = False
+        self._free.put(None) # wake up the decoder
+        self._thread.join()
+        return 0
+    
+    
+    def seek(self, time=0.0):
+        """
+        Continue playback at the given time in seconds.
+        """
+        return self.setpos(int(time*self.samplerate))
+    
+    
+    def setpos(self, pos=0):
+        """
+        Continue playback at the given position in frames. Buffers that were
+        decoded ahead are dropped.
+        """
+        with self._lock:
+            self._generation += 1
+            self._seek_to = pos
+            self.pos = pos
+            # hand the dropped buffers back right away, so decoding the new
+            # position doesn't wait for the next callbacks (the decoder
+            # can't start on it while the lock is held)
+            while True:
+                try:
+                    generation, i, old_pos, frames = self._filled.get_nowait()
+                except Queue.Empty:
+                    break
+                if i is not None:
+                    self._free.put(i)
+        return 0
+    
+    
+    def getpos(self):
+        """
+        Return the position in frames of the next frame that is played.
+        """
+        return self.pos
+    
+    
+    def tell(self):
+        """
+        Return the position in seconds of the next frame that is played.
+        """
+        return self.pos/float(self.samplerate)
+    
+    
+    def duration(self):
+        return self.analyzer.wave_duration()
+    
+    
+    def get_callback(self):
+        """
+        Return a PyAudio stream callback that plays the decoded buffers.
+        """
+        def callback(in_data, frame_count, time_info, status):
+            """Audio playback loop; doesn't decode or allocate"""
+            if self._playing is not None:
+                self._free.put(self._playing) # the device is done with it
+                self._playing = None
+            if self.paused:
+                return self._silence[:frame_count].data, pyaudio.paContinue
+            while True:
+                try:
+                    generation, i, pos, frames = self._filled.get_nowait()
+                except Queue.Empty:
+                    self.underruns += 1
+                    return self._silence[:frame_count].data, \
+                        pyaudio.paContinue
+                if generation == self._generation:
+                    break
+                if i is not None:
+                    self._free.put(i) # decoded before the last seek
+            if i is None: # end of file
+                return self._silence[:frame_count].data, pyaudio.paComplete
+            self._playing = i
+            self.pos = pos+frames
+            if self.on_play:
+                self.on_play(pos/float(self.samplerate), time_info)
+            # the array's buffer goes to PyAudio without copying
+            return self._buffers[i][:frame_count].data, pyaudio.paContinue
+    
+        return callback
+    
+    
+    def _decode(self):
+        """
+        Decoding thread: fill free buffers with the following blocks.
+        """
+        generation = None
+        pos = 0
+        while self._running:
+            i = self._free.get()
+            if i is None:
+                break
+            with self._lock:
+                if generation != self._generation:
+                    generation = self._generation
+                    pos = self._seek_to
+            frames = min(self.block_size, self.analyzer.data_nframes-pos)
+            if frames <= 0:
+                self._free.put(i)
+                self._filled.put((generation, None, pos, 0))
+                # wait for a seek instead of filling the queue with ends
+                while self._running and generation == self._generation:
+                    time.sleep(0.05)
+                continue
+            self.analyzer.wave_setpos(pos)
+            self.analyzer.wave_read(frames=frames)
+            self._convert(self.analyzer.data, self._buffers[i])
+            self._filled.put((generation, i, pos, frames))
+            pos += frames
+        return 0
+    
+    
+    def _convert(self, samples, buffer):
+        """
+        Convert float samples to the sample format, padding with silence.
+        """
+        frames = len(samples)
+        if self.sample_format == 'int16':
+            numpy.multiply(samples, 32767, out=self._scratch[:frames])
+            numpy.clip(
+                self._scratch[:frames], -32768, 32767,
+                out=self._scratch[:frames]
+            )
+            buffer[:frames] = self._scratch[:frames]
+        else:
+            buffer[:frames] = samples
+        buffer[frames:] = 0
+        return 0
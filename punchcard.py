@@ -2,10 +2,12 @@
 Explode Visualisation
 """
 
+import numpy
 import cairo
 import visualizer
 import animation
 import helpers
+import raster
 import math
 
 class PunchcardVisualizer(visualizer.Visualizer):
@@ -30,69 +32,78 @@ class PunchcardVisualizer(visualizer.Visualizer):
         self.history_len = \
             8 #40
                 
-        self.pixels = [[(0,0.0)] * self.freq_steps] * self.history_len
+        self.pixels = numpy.zeros((self.history_len, self.freq_steps))
+        self.row_factors = \
+            1-numpy.arange(self.history_len)/float(self.history_len)
+        self.raster = None
         self.col_bg = cairo.SolidPattern(0, 0, 0)
         self.col_power_curve = cairo.SolidPattern(0.5, 0.6, 1, 0.2)
         self.col_power_total = cairo.SolidPattern(0.5, 0.8, 1, 0.3)
+        # the scale only changes with the log power window
+        self.add_static_layer('scale', self.draw_scale, (3, 4))
         
         return
     
     
     def draw(self):
         
-        power_avg = False
-        if(self.power_avg[1] == 1):
-            power_avg = True
+        # the bins have always been averaged; 'Add / Avg' never switched that
+        power_mode = 'mean'
         
         if(self.freq_bins[1] == 0):
-            powers = self.a.list_freq_bin_powers(
+            powers = self.a.freq_bin_powers(
                 self.a.logarithmic_bins(
                     self.freq_min[1], self.freq_max[1], self.freq_steps, 2
                 ),
-                power_avg
+                power_mode
             )
             self.freq_steps = 100
         elif(self.freq_bins[1] == 1):
-            powers = self.a.list_freq_bin_powers(
+            powers = self.a.freq_bin_powers(
                 self.a.linear_bins(
                     self.freq_min[1], self.freq_max[1], self.freq_steps
                 ),
-                power_avg
+                power_mode
             )
             self.freq_steps = 100
         else:
-            powers = self.a.list_freq_powers()
+            powers = numpy.array(self.a.freq_powers[:-1])
             self.freq_steps = len(powers)
         
-        self.pixels.pop()
-        self.pixels.insert(0, powers)
+        if self.pixels.shape[1] != len(powers):
+            self.pixels = numpy.zeros((self.history_len, len(powers)))
+            self.raster = None
+        self.pixels[1:] = self.pixels[:-1]
+        self.pixels[0] = powers
         
         self.c.set_source(self.col_bg)
         self.c.paint()
-             
-        for row_i, row_pixels in enumerate(self.pixels):
-            for pixel_i, pixel in enumerate(row_pixels):
-                pixel = self.a.logarithmic_scale(
-                    val=pixel[1],
-                    log_min=self.log_scale_min[1],
-                    log_max=self.log_scale_max[1]
-                )
-                fac = 1-(float(row_i)/self.history_len)
-                color = cairo.SolidPattern(fac*pixel, fac*pixel, fac*pixel, 1.0)
-                w = self.w/self.freq_steps
-                h = self.h/self.history_len
-                x = pixel_i * w
-                y = (self.h/self.history_len)*row_i
-                self.c.rectangle(x, y, w, h)
-                self.c.set_source(color)
-                self.c.fill()
-            #
         
-        self.draw_scale()
+        # one pixel per frequency and row, scaled to cells of the same size
+        # as ever (integer pixels); only where that leaves no room for the
+        # cells (more frequencies than pixels) they share the whole width
+        w = self.w/self.freq_steps
+        h = self.h/self.history_len
+        if self.raster is None:
+            self.raster = raster.Raster(len(powers), self.history_len)
+        self.raster.set_intensities(
+            self.a.logarithmic_scale(
+                val=self.pixels,
+                log_min=self.log_scale_min[1],
+                log_max=self.log_scale_max[1]
+            ),
+            self.row_factors
+        )
+        self.raster.paint(
+            self.c, 0, 0, len(powers)*w if w else self.w, self.history_len*h
+        )
+        
+        self.paint_static_layer('scale')
         
         N = len(self.a.freq_powers[1:-1])+1
-        powers = [x*N for x in self.a.freq_powers[1:-1]]
-        total_power = (1.0/N)*math.sqrt(sum(powers)) # rms        
+        total_power = (1.0/N)*math.sqrt(
+            numpy.sum(self.a.freq_powers[1:-1])*N
+        ) # rms        
         x = self.w*total_power
         y = self.a.logarithmic_scale(
             val=total_power,
@@ -110,21 +121,21 @@ class PunchcardVisualizer(visualizer.Visualizer):
         return
     
     
-    def draw_scale(self):
+    def draw_scale(self, context, width, height):
         
-        for x in range(0, self.w-1):
+        for x in range(0, width-1):
             y = self.a.logarithmic_scale(
                 val=x,
                 in_min=0,
-                in_max=self.w-1,
-                out_min=self.h-1,
+                in_max=width-1,
+                out_min=height-1,
                 out_max=0,
                 log_min=self.log_scale_min[1],
                 log_max=self.log_scale_max[1]
             )
-            self.c.rectangle(x-1, y-1, 2, 2)
+            context.rectangle(x-1, y-1, 2, 2)
         
-        self.c.set_source(self.col_power_curve)
-        self.c.fill()
+        context.set_source(self.col_power_curve)
+        context.fill()
         
         return
\ No newline at end of file
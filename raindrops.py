@@ -23,10 +23,7 @@ class RaindropsVisualizer(visualizer.Visualizer):
         self.hue = 0
         #self.bg_pattern = cairo.LinearGradient(0, 0, 0, self.h)
         #self.bg_color_stops = [(1, self.t.tell())]
-        self.vignette_pattern = cairo.LinearGradient(0, 0, 0, self.h)
-        self.vignette_pattern.add_color_stop_rgba(0, 0, 0, 0, 0.0)
-        self.vignette_pattern.add_color_stop_rgba(0.5, 0, 0, 0, 0.0)
-        self.vignette_pattern.add_color_stop_rgba(1, 0, 0, 0, 0.8)
+        self.add_static_layer('vignette', self.draw_vignette)
         self.offset_top = self.h*0.05
         self.spacing = 5
         self.stroke_pattern = cairo.SolidPattern(0, 0, 0, 0.01)
@@ -95,7 +92,7 @@ class RaindropsVisualizer(visualizer.Visualizer):
                 layer['hue_offset'], layer['saturation'],
                 layer['value'], layer['opacity'], layer['threshold']
             )
-        self.draw_vignette()
+        self.paint_static_layer('vignette')
         return 0
     
     
@@ -142,14 +139,14 @@ class RaindropsVisualizer(visualizer.Visualizer):
     
     def add_raindrops(self, addto, cols, threshold, freq_crop_bottom=30, 
             log_base=600):
-        powers = self.a.list_freq_bin_powers(
+        powers = self.a.freq_bin_powers(
             bins = self.a.logarithmic_bins(
                 start=self.min_freq, stop=self.max_freq, 
                 num=cols+freq_crop_bottom+1
             )
         )[freq_crop_bottom:]
-        for i, freq in enumerate(powers):
-            val = helpers.logarithmic(freq[1], base=log_base)
+        for i, power in enumerate(powers):
+            val = helpers.logarithmic(power, base=log_base)
             if val > threshold:
                 addto.append((val, i, self.rt.tell()))
         return 0
@@ -193,8 +190,12 @@ class RaindropsVisualizer(visualizer.Visualizer):
         return 0
     
     
-    def draw_vignette(self):
-        self.c.set_source(self.vignette_pattern)
-        self.c.rectangle(0, 0, self.w, self.h)
-        self.c.fill()
+    def draw_vignette(self, context, width, height):
+        vignette_pattern = cairo.LinearGradient(0, 0, 0, height)
+        vignette_pattern.add_color_stop_rgba(0, 0, 0, 0, 0.0)
+        vignette_pattern.add_color_stop_rgba(0.5, 0, 0, 0, 0.0)
+        vignette_pattern.add_color_stop_rgba(1, 0, 0, 0, 0.8)
+        context.set_source(vignette_pattern)
+        context.rectangle(0, 0, width, height)
+        context.fill()
         return 0
\ No newline at end of file
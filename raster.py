@@ -0,0 +1,133 @@
+"""
+Draw grids of intensities as images.
+
+Visualizers like `ExplodeVisualizer` and `PunchcardVisualizer` show a history
+of spectra as a grid of cells. Filling every cell with a rectangle of its own
+color means thousands of cairo calls per frame. A `Raster` writes the grid
+with a few array operations straight into the memory of a cairo image surface
+(one pixel per cell) instead, looking up the colors in a colormap, and the
+surface is then scaled onto the target with a single nearest neighbour paint.
+"""
+
+import numpy
+import cairo
+
+
+def colormap(stops, size=256):
+    """
+    Return a lookup table of `size` ARGB32 pixel values (`numpy.uint32`, in
+    the machine's byte order like cairo's) interpolated between color stops.
+
+    Arguments:
+    stops       List of tuples `(position, (r, g, b[, a]))`, with positions
+                from 0 to 1 in ascending order and color components from 0
+                to 1
+    size        Number of entries
+    """
+    positions = numpy.array([stop[0] for stop in stops], dtype=numpy.float64)
+    colors = numpy.array(
+        [tuple(stop[1])+(1.0,)*(4-len(stop[1])) for stop in stops],
+        dtype=numpy.float64
+    )
+    x = numpy.linspace(0, 1, size)
+    channels = [
+        numpy.interp(x, positions, colors[:, i]) for i in range(4)
+    ]
+    alpha = channels[3]
+    # cairo's pixels are premultiplied
+    r, g, b, a = [
+        numpy.round(channel*(alpha if i < 3 else 1)*255).astype(numpy.uint32)
+        for i, channel in enumerate(channels)
+    ]
+    return (a << 24) | (r << 16) | (g << 8) | b
+
+
+grey = colormap(((0, (0, 0, 0)), (1, (1, 1, 1))))
+
+
+class Raster:
+    """
+    Attributes:
+    width       Number of columns of the grid
+    height      Number of rows of the grid
+    lut         Colormap the intensities are looked up in (see `colormap()`)
+    pixels      `(height, width)` `numpy.uint32` view of the surface's pixels
+    surface     `cairo.ImageSurface` that shares its memory with `pixels`
+    """
+    
+    width = 0
+    height = 0
+    lut = None
+    pixels = None
+    surface = None
+    
+    
+    def __init__(self, width, height, lut=None):
+        """
+        Arguments:
+        width       Number of columns
+        height      Number of rows
+        lut         Colormap (defaults to `grey`)
+        """
+        self.width = width
+        self.height = height
+        self.lut = grey if lut is None else lut
+        stride = cairo.ImageSurface.format_stride_for_width(
+            cairo.FORMAT_ARGB32, width
+        )
+        self._data = numpy.zeros((height, stride//4), dtype=numpy.uint32)
+        self.pixels = self._data[:, :width]
+        self.surface = cairo.ImageSurface.create_for_data(
+            self._data, cairo.FORMAT_ARGB32, width, height, stride
+        )
+        self._scaled = numpy.empty((height, width), dtype=numpy.float64)
+        self._index = numpy.empty((height, width), dtype=numpy.intp)
+    
+    
+    def set_intensities(self, values, factors=None, rows=None):
+        """
+        Color the pixels by intensities from 0 to 1 (values outside are
+        clipped).
+    
+        Arguments:
+        values      `(height, width)` array of intensities, or an array of
+                    rows of intensities that `rows` picks from
+        factors     Optional array of length `height` every row is multiplied
+                    by (e.g. to fade out older rows)
+        rows        Optional array of length `height` with the index of the
+                    row of `values` that every row of the raster shows
+        """
+        scaled = self._scaled
+        if rows is None:
+            scaled[...] = values
+        else:
+            numpy.take(values, rows, axis=0, out=scaled)
+        if factors is None:
+            numpy.multiply(scaled, len(self.lut)-1, out=scaled)
+        else:
+            numpy.multiply(
+                scaled, numpy.multiply(factors, len(self.lut)-1)[:, None],
+                out=scaled
+            )
+        numpy.clip(scaled, 0, len(self.lut)-1, out=scaled)
+        numpy.add(scaled, 0.5, out=scaled)
+        self._index[...] = scaled # rounds down
+        self.surface.flush()
+        numpy.take(self.lut, self._index, out=self.pixels, mode='clip')
+        self.surface.mark_dirty()
+        return 0
+    
+    
+    def paint(self, context, x, y, width, height):
+        """
+        Scale the raster onto a rectangle of `context` without smoothing.
+        """
+        context.save()
+        context.translate(x, y)
+        context.scale(width/float(self.width), height/float(self.height))
+        context.set_source_surface(self.surface, 0, 0)
+        context.get_source().set_filter(cairo.FILTER_NEAREST)
+        context.rectangle(0, 0, self.width, self.height)
+        context.fill()
+        context.restore()
+        return 0
@@ -0,0 +1,200 @@
+"""
+Cache the spectrum of whole WAV files on disk.
+
+Analyzing a file only depends on its contents and on the analysis parameters,
+so the result of a render (or a live playback) can be reused by the next one.
+`SpectrumCache` stores one spectrogram (a row of `AudioAnalyze.freq_powers`
+for every frame) per file and parameter set as a `.npy` file, which is
+memory-mapped when loaded again.
+
+Invalidation: entries are keyed by a hash of the file contents, the analysis
+parameters and `SpectrumCache.version`. A changed file or changed parameters
+simply never hit an old entry again; the old entries age out of the cache
+directory, which is kept below `max_size` bytes by deleting the least
+recently used entries.
+"""
+
+import os
+import math
+import hashlib
+import numpy
+
+
+class SpectrumCache:
+    """
+    Size-bounded directory of cached spectrograms.
+    
+    Attributes:
+    directory   Directory the spectrograms are stored in
+    max_size    Maximum total size of the directory in bytes
+    dtype       Data type spectrograms are stored with; float16 halves the
+                size, but very quiet frames may round to zero
+    version     Bump this when the analysis changes to invalidate all entries
+    """
+    
+    directory = None
+    max_size = 2**30
+    dtype = numpy.float32
+    version = 4
+    
+    _hashes = {} # (path, size, mtime) -> content hash
+    
+    
+    def __init__(self, directory=None, max_size=2**30, dtype=numpy.float32):
+        if not directory:
+            directory = os.path.join(
+                os.environ.get(
+                    'XDG_CACHE_HOME', os.path.expanduser('~/.cache')
+                ),
+                'music-visualization'
+            )
+        self.directory = directory
+        self.max_size = max_size
+        self.dtype = dtype
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+    
+    
+    def spectrogram(self, analyzer, path, fps=30, window_func='hann',
+            A_weighting=False, weighting=None, frame_size=None):
+        """
+        Return the spectrogram of the WAV file at `path` as analyzed by
+        `analyzer` with the given parameters (see
+        `AudioAnalyze.analyze_batch()`), from the cache if possible. The
+        result is a read-only array with one row per frame.
+        """
+        if A_weighting and not weighting:
+            weighting = 'A'
+        if not frame_size:
+            frame_size = analyzer.frame_size(fps)
+        key = self.key(
+            path, fps, window_func, weighting, analyzer.downmix, frame_size
+        )
+        spectrogram = self.load(key)
+        if spectrogram is None:
+            spectrogram = self.analyze(
+                key, analyzer, fps, window_func, weighting, frame_size
+            )
+        return spectrogram
+    
+    
+    def analyze(self, key, analyzer, fps=30, window_func='hann',
+            weighting=None, frame_size=None, chunk_size=1024):
+        """
+        Analyze the file of `analyzer` into the entry for `key` and return
+        the stored spectrogram. The rows are analyzed `chunk_size` at a time
+        and written straight to the file through a memory map, so the whole
+        spectrogram is never in memory.
+        """
+        if not frame_size:
+            frame_size = analyzer.frame_size(fps)
+        frames = int(math.ceil(analyzer.wave_duration()*fps))+1
+        num_keys = analyzer.fft_backend.fast_size(frame_size)//2+1
+        path = self._path(key)
+        tmp_path = path+'.tmp'
+        out = numpy.lib.format.open_memmap(
+            tmp_path, mode='w+', dtype=self.dtype, shape=(frames, num_keys)
+        )
+        for start in range(0, frames, chunk_size):
+            stop = min(start+chunk_size, frames)
+            out[start:stop] = analyzer.analyze_batch(
+                start, stop, fps=fps, window_func=window_func,
+                weighting=weighting, frame_size=frame_size, dtype=self.dtype
+            )
+        out.flush()
+        del out # close the map before the file is renamed
+        os.rename(tmp_path, path) # readers never see half written files
+        self.evict()
+        return self.load(key)
+    
+    
+    def key(self, path, fps=30, window_func='hann', weighting=None,
+            downmix=False, frame_size=0):
+        """
+        Return the cache key for a file and a set of analysis parameters.
+        """
+        params = '{0:s}|{1:d}|{2:d}|{3:s}|{4:s}|{5:s}|{6:s}|{7:d}'.format(
+            self.file_hash(path),
+            int(fps*1000),
+            frame_size,
+            getattr(window_func, '__name__', str(window_func)),
+            str(weighting),
+            str(bool(downmix)),
+            numpy.dtype(self.dtype).name,
+            self.version
+        )
+        return hashlib.sha1(params.encode('utf-8')).hexdigest()
+    
+    
+    def file_hash(self, path):
+        """
+        Return a hash of the contents of the file at `path`. Hashes are kept
+        in memory as long as the file's size and modification time stay the
+        same.
+        """
+        stat = os.stat(path)
+        stamp = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+        if not stamp in self._hashes:
+            sha1 = hashlib.sha1()
+            with open(path, 'rb') as fileobj:
+                block = fileobj.read(2**20)
+                while block:
+                    sha1.update(block)
+                    block = fileobj.read(2**20)
+            self._hashes[stamp] = sha1.hexdigest()
+        return self._hashes[stamp]
+    
+    
+    def load(self, key):
+        """
+        Return the memory-mapped spectrogram stored for `key`, or None.
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        os.utime(path, None) # mark as recently used
+        return numpy.load(path, mmap_mode='r')
+    
+    
+    def store(self, key, spectrogram):
+        """
+        Store a spectrogram for `key`, evict old entries and return the
+        stored spectrogram.
+        """
+        path = self._path(key)
+        tmp_path = path+'.tmp'
+        with open(tmp_path, 'wb') as fileobj:
+            numpy.save(fileobj, numpy.asarray(spectrogram, dtype=self.dtype))
+        os.rename(tmp_path, path) # readers never see half written files
+        self.evict()
+        return self.load(key)
+    
+    
+    def evict(self):
+        """
+        Delete the least recently used spectrograms until the cache
+        directory is smaller than `max_size`. Returns the number of deleted
+        entries.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npy'):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+        entries.sort()
+        deleted = 0
+        # never delete the newest entry, even if it is too large by itself
+        while total > self.max_size and len(entries) > 1:
+            mtime, size, name = entries.pop(0)
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+            deleted += 1
+        return deleted
+    
+    
+    def _path(self, key):
+        return os.path.join(self.directory, key+'.npy')
+
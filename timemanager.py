@@ -1,8 +1,44 @@
 """
 Tells the time in the context of the current visualization
+
+The time comes from one of these clock sources:
+'monotonic' A clock that never jumps (`time.monotonic()` if available, else
+            `CLOCK_MONOTONIC`, else `time.time()`)
+'audio'     The position of the audio that is being heard: the audio
+            callback reports which position is handed to the device at which
+            device time (`sync_audio()`), the device clock (e.g. PyAudio's
+            `Stream.get_time`) tells how far playback has come since, and
+            the output latency is subtracted once when telling the time
+'simulated' Like 'audio', but the device clock only moves with `advance()`
+'frames'    `iteration/fps`, for rendering
+All calls to `tell()` between two calls to `frame()` return the same time.
 """
 
 import time
+import ctypes
+import ctypes.util
+
+
+def _clock_gettime():
+    """Return a function that reads CLOCK_MONOTONIC, or None."""
+    try:
+        librt = ctypes.CDLL(
+            ctypes.util.find_library('rt') or ctypes.util.find_library('c'),
+            use_errno=True
+        )
+        clock_gettime = librt.clock_gettime
+    except (OSError, AttributeError, TypeError):
+        return None
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+    value = timespec()
+    def monotonic():
+        clock_gettime(1, ctypes.byref(value)) # CLOCK_MONOTONIC
+        return value.tv_sec+value.tv_nsec*1e-9
+    return monotonic
+
+
+monotonic = getattr(time, 'monotonic', None) or _clock_gettime() or time.time
 
 
 class TimeManager:
@@ -14,44 +50,130 @@ class TimeManager:
     
     start_time = 0
     pause_time = None
+    snapshot = None # time of the current frame
     
     intervals = {} # contains info on how many times an interval has been repeated
     live = True
     fps = 30.0
     
+    source = 'monotonic'
+    clock = None # device clock of the 'audio' source
+    latency = 0.0 # output latency of the device in seconds
+    simulated_time = 0.0
     
-    def __init__(self, main=None, live=True, fps=30.0):
+    
+    def __init__(self, main=None, live=True, fps=30.0, source=None,
+            clock=None, latency=0.0):
+        """
+        Arguments:
+        main        Time manager whose time this one follows
+        live        Wether to follow a clock or the frame count
+        fps         Frames per second when not live
+        source      'monotonic', 'audio', 'simulated' or 'frames' (default:
+                    'monotonic' if live, else 'frames')
+        clock       Function that returns the device time for 'audio'
+        latency     Seconds from handing audio to the device until it is
+                    heard, for devices that don't report when it is heard
+        """
         self.main = main
         self.live = live
         self.fps = fps
+        if not source:
+            source = 'monotonic' if live else 'frames'
+        if not source in ('monotonic', 'audio', 'simulated', 'frames'):
+            raise ValueError("Unknown clock source")
+        self.source = source
+        self.clock = clock
+        self.latency = latency
+        self._sync = (0.0, 0.0)
+        self._floor = 0.0
         self.start()
     
     
     def now(self):
         if self.main:
             return self.main.tell()
+        elif self.source == 'frames':
+            return (1.0/self.fps)*self.iteration
+        elif self.source == 'monotonic':
+            return monotonic()
         else:
-            if self.live:
-                return time.time()
-            else:
-                return (1.0/self.fps)*self.iteration
+            # the position that is handed to the device right now
+            position, device_time = self._sync
+            return position+self.device_time()-device_time
+    
+    
+    def device_time(self):
+        """Return the time of the device clock of the audio sources."""
+        if self.source == 'simulated':
+            return self.simulated_time
+        if self.clock:
+            return self.clock()
+        return monotonic()
+    
+    
+    def sync_audio(self, position, time_info=None):
+        """
+        Audio sources: the audio at `position` seconds is handed to the
+        device now, and heard at the time
+        `time_info['output_buffer_dac_time']` of the device clock (or, if
+        the device doesn't report that, `latency` seconds from now). Call
+        this from the audio callback with the position of the first frame of
+        the buffer.
+        """
+        device_time = 0
+        if time_info:
+            device_time = time_info.get('output_buffer_dac_time', 0)
+        if device_time:
+            # `current()` adds the latency back
+            device_time -= self.latency
+        else:
+            device_time = self.device_time()
+        self._sync = (position, device_time) # a single, atomic assignment
+        return 0
+    
+    
+    def advance(self, seconds):
+        """Move the simulated device clock forward."""
+        self.simulated_time += seconds
+        return 0
     
     
     def tell(self, start_time=None):
-        if not self.pause_time:
+        if self.snapshot is not None:
+            return self.snapshot
+        return self.current()
+    
+    
+    def current(self):
+        """Return the time right now, instead of the time of the frame."""
+        if self.pause_time is None and self._audio():
+            # what is heard is `latency` behind what is handed to the device;
+            # stay at the time that was started, seeked or unpaused at until
+            # the audio from there is heard instead of going back
+            return max(self.now()-self.latency, self._floor)
+        if self.pause_time is None:
             return self.now()-self.start_time
         else:
             return self.pause_time-self.start_time
     
     
     def set(self, t=0):
-        self.start_time += self.tell()-t
+        if self._audio():
+            # until the audio callback reports the new position
+            self._anchor(t)
+            if self.pause_time is not None:
+                self.pause_time = t
+        else:
+            self.start_time += self.current()-t
+        self._resnap()
         return 0
     
     
     def frame(self):
         self.iteration += 1
         self.time = self.now()
+        self.snapshot = self.current()
         for interval in self.intervals:
             if self.intervals[interval][1]:
                 self.intervals[interval][0] += 1
@@ -60,29 +182,95 @@ class TimeManager:
     
     
     def start(self):
-        self.start_time = self.now()
+        if self._audio():
+            # audio sources tell the position in the audio itself
+            self.start_time = 0
+            self._anchor(0.0)
+        else:
+            self.start_time = self.now()
+        self._resnap()
         return 0
     
     
     def pause(self):
-        self.pause_time = self.now()
+        if self._audio():
+            self.pause_time = self.current() # what is heard, not handed over
+        else:
+            self.pause_time = self.now()
+        self._resnap()
         return 0
     
         
     def unpause(self):
-        if not self.pause_time:
+        if self.pause_time is None:
             return 1
         pause_length = self.now()-self.pause_time
+        if self._audio():
+            self._anchor(self.pause_time)
+        else:
+            self.start_time += pause_length
         self.pause_time = None
-        self.start_time += pause_length
+        self._resnap()
         return pause_length
     
     
     def interval(self, interval=1):
         interval = float(interval)
         if not interval in self.intervals:
-            self.intervals[interval] = [0, False]
+            # count the intervals before now as if they had fired, so a
+            # render that starts in the middle fires like one from the start
+            self.intervals[interval] = [int(self.tell()/interval), False]
         if self.tell()/interval > self.intervals[interval][0]:
             self.intervals[interval][1] = True
             return True
-        return False
\ No newline at end of file
+        return False
+    
+    
+    def get_state(self):
+        """Return the time as a dictionary that can be pickled."""
+        return {
+            'time' : self.time,
+            'iteration' : self.iteration,
+            'start_time' : self.start_time,
+            'pause_time' : self.pause_time,
+            'snapshot' : self.snapshot,
+            'intervals' : dict(
+                (interval, list(count))
+                for interval, count in self.intervals.items()
+            ),
+            'simulated_time' : self.simulated_time,
+            'sync' : self._sync,
+            'floor' : self._floor,
+        }
+    
+    
+    def set_state(self, state):
+        """Restore a state returned by `get_state()`."""
+        self.time = state['time']
+        self.iteration = state['iteration']
+        self.start_time = state['start_time']
+        self.pause_time = state['pause_time']
+        self.snapshot = state['snapshot']
+        self.intervals = state['intervals']
+        self.simulated_time = state['simulated_time']
+        self._sync = state['sync']
+        self._floor = state.get('floor', 0.0)
+        return 0
+    
+    
+    def _anchor(self, t):
+        """Audio sources: continue at `t`, handed to the device now."""
+        self._sync = (t, self.device_time())
+        self._floor = t
+        return 0
+    
+    
+    def _audio(self):
+        return not self.main and self.source in ('audio', 'simulated')
+    
+    
+    def _resnap(self):
+        """Update the frame time after the time was changed."""
+        if self.snapshot is not None:
+            self.snapshot = self.current()
+        return 0
\ No newline at end of file
@@ -1,14 +1,24 @@
 #!/usr/bin/env python2.7
 
 import argparse
-import struct
 import ctypes
+import math
+import os
+import sys
+import random
+import pickle
+import multiprocessing
 
 import sdl2
 import pyaudio
 import cairo
 
 import audioanalyze
+import analysisworker
+import beatdetect
+import framesink
+import playback
+import spectrumcache
 import timemanager
 import cairowindow
 
@@ -25,6 +35,10 @@ class Main:
     live = True
     
     analyzer = None
+    recorder = None
+    worker = None
+    frames = None
+    beats = None
     player = None
     surface = None
     window = None
@@ -60,16 +74,31 @@ class Main:
         arg_parser.add_argument('-x', '--width', type=int, default=640)
         arg_parser.add_argument('-y', '--height', type=int, default=360)
         arg_parser.add_argument('-o', '--output', type=str, default='')
+        arg_parser.add_argument('-k', '--sink', type=str, default='png',
+            choices=sorted(framesink.sinks))
+        arg_parser.add_argument('-j', '--jobs', type=int, default=1)
+        arg_parser.add_argument('-u', '--warmup', type=float, default=5.0)
+        arg_parser.add_argument('-r', '--resume', type=bool, default=False)
+        arg_parser.add_argument('-e', '--checkpoint', type=float, default=60.0)
         arg_parser.add_argument('-f', '--fps', type=int, default=30)
         arg_parser.add_argument('-v', '--visualizer', type=int, default=0)
         arg_parser.add_argument('-m', '--micin', type=bool, default=False)
         arg_parser.add_argument('-a', '--amplify', type=int, default=1)
         arg_parser.add_argument('-s', '--samprate', type=int, default=22000)
         arg_parser.add_argument('-l', '--fullscreen', type=bool, default=False)
+        arg_parser.add_argument('-c', '--cache_dir', type=str, default='')
+        arg_parser.add_argument('-w', '--window_size', type=int, default=0)
+        arg_parser.add_argument('-p', '--worker', type=bool, default=False)
         self.args = arg_parser.parse_args()
+        if self.args.output == '-':
+            # the frames go to stdout, so messages mustn't
+            sys.stdout = sys.stderr
         if self.args.output != '':
             self.live = False
             self.time = timemanager.TimeManager(live=False, fps=self.args.fps)
+        elif not self.args.micin:
+            # follow the audio that is being heard
+            self.time = timemanager.TimeManager(source='audio')
         # TODO normalization
         # TODO only allow certain arguments with each other
         # SET UP AUDIO
@@ -78,25 +107,61 @@ class Main:
         else:
             self.analyzer = audioanalyze.AudioAnalyze()
         
+        if self.args.cache_dir and not self.args.micin:
+            cache = spectrumcache.SpectrumCache(self.args.cache_dir)
+            frame_size = self.args.window_size \
+                or self.analyzer.frame_size(self.args.fps)
+            print(" * Loading spectrum from cache")
+            self.analyzer.use_spectrogram(
+                cache.spectrogram(
+                    self.analyzer,
+                    self.args.wave_file,
+                    fps=self.args.fps,
+                    A_weighting=not self.live,
+                    frame_size=frame_size
+                ),
+                self.args.fps,
+                self.analyzer.fft_backend.fast_size(frame_size)
+            )
+        
         if self.live and not self.args.micin:
-            self.player = audioanalyze.AudioAnalyze(self.args.wave_file)
-            self.player.wave_read(frames=256)
+            self.player = playback.Playback(
+                self.args.wave_file, block_size=self.audio_buffer_length
+            )
             self.pa = pyaudio.PyAudio()
             self.pa_audio_stream = self.pa.open(
-                rate=self.player.data_samplerate,
-                format=pyaudio.paUInt8,
+                rate=self.player.samplerate,
+                format=self.player.format(),
                 channels=1,
                 output=True,
-                stream_callback=self.get_audio_loop() # yes that's correct
+                frames_per_buffer=self.audio_buffer_length,
+                stream_callback=self.get_audio_loop(), # yes that's correct
+                start=False
             )
+            self.time.clock = self.pa_audio_stream.get_time
+            self.time.latency = self.pa_audio_stream.get_output_latency()
+            self.player.on_play = self.time.sync_audio
+            if self.args.worker and self.analyzer.spectrogram is None:
+                # analyze in a separate process that follows the player
+                self.worker = analysisworker.AnalysisWorker(
+                    self.args.wave_file,
+                    fps=self.args.fps,
+                    frame_size=self.args.window_size
+                )
         elif self.live and self.args.micin:
+            # the recorder analyzes on PyAudio's thread and publishes
+            # snapshots that the analyzer loads before each frame is drawn
+            self.recorder = audioanalyze.AudioAnalyze()
+            self.recorder.data_samplerate = self.args.samprate
+            self.recorder.data_framerate = self.args.samprate
+            self.frames = audioanalyze.AnalysisBuffer()
             self.pa = pyaudio.PyAudio()
             self.pa_audio_stream = self.pa.open(
                 rate=self.args.samprate,
                 format=pyaudio.paUInt8,
                 channels=1,
                 input=True,
-                frames_per_buffer=1024, #int(self.args.samprate*(1.0/self.args.fps)),
+                frames_per_buffer=self.audio_buffer_length, #int(self.args.samprate*(1.0/self.args.fps)),
                 stream_callback=self.get_audio_loop()
             )
             self.analyzer.data_samplerate = self.args.samprate
@@ -115,9 +180,15 @@ class Main:
             self.window = cairowindow.CairoWindow(
                 self.surface, title='Visualizer'
             )
-            self.window.loop_sleep = 0.5/self.args.fps #0 # 1/25.0
+            self.window.fps = self.args.fps # paced by a FrameScheduler
         
         # SET UP VISUALIZERS
+        if self.args.micin:
+            self.beats = beatdetect.OnsetDetector(
+                self.args.samprate/float(self.audio_buffer_length)
+            )
+        else:
+            self.beats = beatdetect.OnsetDetector(self.args.fps)
         self.visualizers = [None] * len(self.available_visualizers)
         if(len(self.available_visualizers) == 0):
             print "No visualizer available."
@@ -126,10 +197,7 @@ class Main:
         if(self.current_visualizer > len(self.available_visualizers)):
             self.current_visualizer = 0
             print "Invalid visualizer: Using first."
-        for i, visualizer in enumerate(self.available_visualizers):
-            self.visualizers[i] = \
-                visualizer(self.analyzer, self.surface, self.time)
-            self.visualizers[i].setup()
+        self.create_visualizers()
         
         # SET UP FULLSCREEN
         if self.args.fullscreen:
@@ -146,10 +214,24 @@ class Main:
         return 0
     
     
+    def create_visualizers(self):
+        """Create and set up all visualizers on the current surface, analyzer,
+        time manager and onset detector."""
+        for i, visualizer in enumerate(self.available_visualizers):
+            self.visualizers[i] = \
+                visualizer(self.analyzer, self.surface, self.time, self.beats)
+            self.visualizers[i].setup()
+        return 0
+    
+    
     def start(self):
         """Start up Video and Audio that was initialized"""
         if self.live:
             self.list_properties()
+            if self.worker:
+                self.worker.start()
+            if self.player:
+                self.player.start()
             self.pa_audio_stream.start_stream()
             self.time.start()
             self.window.loop(callbacks=[self.window_loop])
@@ -163,9 +245,19 @@ class Main:
         if not self.live:
             return 1
         self.window.close()
+        if self.window.scheduler:
+            print(
+                " * Frames: {frames:d}, late: {late:d}, dropped: {dropped:d}, "
+                "lateness: {mean_lateness:.4f}s mean, {max_lateness:.4f}s max"
+                .format(**self.window.scheduler.stats())
+            )
         self.pa_audio_stream.stop_stream()
         self.pa_audio_stream.close()
         self.pa.terminate()
+        if self.worker:
+            self.worker.stop()
+        if self.player:
+            self.player.stop()
         self.window.loop_running = False
         return 0
     
@@ -192,7 +284,7 @@ class Main:
         elif seekto >= self.analyzer.wave_duration():
             return 1
         self.time.set(seekto)
-        self.player.wave_seek(seekto)
+        self.player.seek(seekto)
         self.analyzer.wave_seek(seekto)
         return 0
     
@@ -263,70 +355,276 @@ class Main:
         self.time.frame()
         self._key_listener()
         # Sync Player and Analyzer, then analyze
-        if not self.args.micin:
-            self.analyzer.file_.setpos(self.player.file_.tell())
+        if self.worker:
+            pos = int(max(self.time.tell(), 0)*self.player.samplerate)
+            # the worker doesn't analyze past the end of the file, like
+            # the analyzer that raises an AudioAnalyzeError there
+            if pos+self.worker.frame_size > self.player.analyzer.data_nframes:
+                self.stop()
+                return 1
+            self.worker.set_position(pos)
+            frame = self.worker.latest_frame()
+            if frame is None: # nothing analyzed yet
+                return 0
+            self.analyzer.load_frame(frame) # normalized by the worker
+            self.beats.update(self.analyzer.freq_powers)
+        elif not self.args.micin:
+            # analyze what is heard right now, not what was handed to the
+            # device last; the audio clock goes on after the end of the file
+            if self.time.tell() >= self.analyzer.wave_duration():
+                self.stop()
+                return 1
             try:
-                self.analyzer.wave_read(1.0/self.args.fps)
-                self.analyzer.analyze(A_weighting=False)
+                self.analyzer.wave_seek(max(self.time.tell(), 0))
+                if self.analyzer.spectrogram is not None:
+                    self.analyzer.spectrogram_read(max(self.time.tell(), 0))
+                else:
+                    self.analyzer_read()
+                    self.analyzer.analyze(A_weighting=False)
                 self.analyzer.normalize()
+                self.beats.update(self.analyzer.freq_powers)
             except audioanalyze.AudioAnalyzeError:
                 self.stop()
                 return 1
+        else:
+            frame = self.frames.latest()
+            if frame is None: # nothing recorded yet
+                return 0
+            self.analyzer.load_frame(frame)
         self.visualizers[self.current_visualizer].draw()
         return 0
     
     
+    def analyzer_read(self):
+        """Read the samples for one frame into the analyzer. With a fixed
+        `--window_size`, the amount of samples analyzed doesn't depend on the
+        frame rate."""
+        if self.args.window_size:
+            return self.analyzer.wave_read(frames=self.args.window_size)
+        return self.analyzer.wave_read(1.0/self.args.fps)
+    
+    
     def get_audio_loop(self):
         """PyAudio can't handle callbacks that are an instance of a class;
         Because of this, this function returns a copy of a callback that will
         use this specific class."""
         
         if not self.args.micin:
-            def callback(in_data, frame_count, time_info, status):
-                """Audio playback/recording loop"""
-                buf = [struct.pack('B', 128)] * frame_count
-                if self.paused:
-                    return ''.join(buf), pyaudio.paContinue
-                try:
-                    self.player.wave_read(frames=frame_count)
-                    for i, frame in enumerate(self.player.data):
-                        buf[i] = struct.pack('B', int((frame+1)/2.0*255))
-                    return ''.join(buf), pyaudio.paContinue
-                except audioanalyze.AudioAnalyzeError:
-                    return None, pyaudio.paComplete
+            # decoded and converted ahead by the player, off PyAudio's thread
+            callback = self.player.get_callback()
         else:
             def callback(in_data, frame_count, time_info, status):
-                self.analyzer.data_nframes = frame_count
-                self.analyzer.wave_parse(
+                self.recorder.data_nframes = frame_count
+                self.recorder.wave_parse(
                     raw_data=in_data,
                     sampwidth=1,
                     nchannels=1
                 )
-                self.analyzer.analyze(A_weighting=True)
-                self.analyzer.normalize()
+                self.recorder.analyze(A_weighting=True)
+                self.recorder.normalize()
+                self.beats.update(self.recorder.freq_powers)
+                self.frames.publish(self.recorder.snapshot(
+                    time_info.get('input_buffer_adc_time', 0.0)
+                ))
                 return None, pyaudio.paContinue
         
         return callback
     
     
     def render(self):
-        """Render PNGs to a directory"""
-        while self.time.tell() < self.analyzer.wave_duration():
+        """Render frames to the sink given with `--sink` at `--output` (a
+        directory of PNGs by default)"""
+        if self.analyzer.spectrogram is None:
+            # analyzed a chunk at a time while drawing, instead of keeping
+            # the spectrum of the whole file in memory
+            frame_size = self.args.window_size \
+                or self.analyzer.frame_size(self.args.fps)
+            self.analyzer.use_spectrogram(
+                audioanalyze.BatchSpectrogram(
+                    self.analyzer,
+                    fps=self.args.fps,
+                    A_weighting=True,
+                    frame_size=frame_size
+                ),
+                self.args.fps,
+                self.analyzer.fft_backend.fast_size(frame_size)
+            )
+        frames = int(math.ceil(self.analyzer.wave_duration()*self.args.fps))
+        if self.args.output == '-':
+            if self.args.jobs > 1:
+                print(" * Can't render in parallel to stdout")
+                return 1
+            self.args.resume = False
+        resume = self.args.resume and os.path.exists(self.args.output)
+        if resume and self.args.jobs > 1:
+            print(" * Resuming in one process")
+            self.args.jobs = 1
+        sink = self.open_sink(frames, create=not resume)
+        if self.args.jobs > 1:
+            sink.close() # created it; the processes open it again
+            if self.render_parallel(frames):
+                return 1
+        else:
+            start, warmup = self.resume(sink) if resume else (0, 0)
+            self.render_frames(
+                sink, start, frames, warmup,
+                int(self.args.checkpoint*self.args.fps)
+            )
+            sink.close()
+            if os.path.exists(self.checkpoint_path()):
+                os.remove(self.checkpoint_path())
+        print(" * Done")
+        return 0
+    
+    
+    def open_sink(self, frames, create=True):
+        return framesink.open_sink(
+            self.args.sink,
+            self.args.output,
+            self.args.width,
+            self.args.height,
+            self.args.fps,
+            frames,
+            create
+        )
+    
+    
+    def render_frames(self, sink, start, stop, warmup=0, checkpoint=0):
+        """Draw the frames from `start` to before `stop` (numbered from 0)
+        and write them to `sink`. The `warmup` frames before `start` are
+        drawn first without writing them, so visualizers that depend on past
+        frames look the same as when rendering from the beginning. Every
+        `checkpoint` frames, a checkpoint is saved."""
+        self.time.iteration = max(start-warmup, 0)
+        if self.time.iteration < start:
+            print(" * Warming up from frame {0:d}".format(self.time.iteration))
+        while self.time.iteration < stop:
             self.time.frame()
-            self.analyzer.wave_seek(self.time.tell())
-            self.analyzer.wave_read(1/float(self.args.fps))
-            self.analyzer.analyze(A_weighting=True)
-            print(" * Drawing frame {0: 3d} ({1:.2f}s)".format(
-                self.time.iteration, self.time.tell()
-            ))
+            index = self.time.iteration-1
+            self.analyzer.spectrogram_read(self.time.tell())
+            self.beats.update(self.analyzer.freq_powers)
+            if index >= start:
+                print(" * Drawing frame {0: 3d} ({1:.2f}s)".format(
+                    self.time.iteration, self.time.tell()
+                ))
             self.visualizers[self.current_visualizer].draw()
-            filename = "{0:s}/{1:05d}.png".format(
-                self.args.output,
-                self.time.iteration
+            if index >= start:
+                sink.write(self.visualizers[self.current_visualizer].s, index)
+                if checkpoint and (index+1)%checkpoint == 0:
+                    self.save_checkpoint(sink, index+1)
+        return 0
+    
+    
+    def checkpoint_path(self):
+        if self.args.sink == 'png':
+            return os.path.join(self.args.output, 'checkpoint.pickle')
+        return self.args.output+'.checkpoint'
+    
+    
+    def checkpoint_params(self):
+        """The parameters a checkpoint is only valid for."""
+        return (
+            os.path.abspath(self.args.wave_file), self.args.width,
+            self.args.height, self.args.fps, self.current_visualizer,
+            self.args.sink
+        )
+    
+    
+    def save_checkpoint(self, sink, frame):
+        """Save everything needed to continue rendering at `frame` after the
+        frames before it are stored."""
+        sink.flush()
+        checkpoint = {
+            'params' : self.checkpoint_params(),
+            'frame' : frame,
+            'time' : self.time.get_state(),
+            'analyzer' : self.analyzer.get_state(),
+            'beats' : self.beats.get_state(),
+            'visualizer' : \
+                self.visualizers[self.current_visualizer].get_state(),
+            'random' : random.getstate(),
+        }
+        path = self.checkpoint_path()
+        with open(path+'.tmp', 'wb') as fileobj:
+            pickle.dump(checkpoint, fileobj, pickle.HIGHEST_PROTOCOL)
+        os.rename(path+'.tmp', path) # never leave half a checkpoint
+        return 0
+    
+    
+    def load_checkpoint(self):
+        """Return the saved checkpoint, or None if there is no checkpoint for
+        these parameters."""
+        if not os.path.exists(self.checkpoint_path()):
+            return None
+        with open(self.checkpoint_path(), 'rb') as fileobj:
+            checkpoint = pickle.load(fileobj)
+        if checkpoint['params'] != self.checkpoint_params():
+            return None
+        return checkpoint
+    
+    
+    def resume(self, sink):
+        """Restore the last checkpoint, or find out how many frames were
+        already written without one; return the frame to continue at and the
+        number of frames to warm up with."""
+        existing = sink.existing_frames()
+        checkpoint = self.load_checkpoint()
+        if checkpoint and (existing is None
+                or checkpoint['frame'] <= existing):
+            self.time.set_state(checkpoint['time'])
+            self.analyzer.set_state(checkpoint['analyzer'])
+            self.beats.set_state(checkpoint['beats'])
+            self.visualizers[self.current_visualizer]\
+                .set_state(checkpoint['visualizer'])
+            random.setstate(checkpoint['random'])
+            print(" * Resuming from checkpoint at frame {0:d}".format(
+                checkpoint['frame']
+            ))
+            return checkpoint['frame'], 0
+        if existing:
+            print(" * Resuming after {0:d} existing frames".format(existing))
+            return existing, int(self.args.warmup*self.args.fps)
+        return 0, 0
+    
+    
+    def render_parallel(self, frames):
+        """Split the frames into `--jobs` segments and render every segment
+        in a process of its own."""
+        bounds = [
+            frames*i//self.args.jobs for i in range(self.args.jobs+1)
+        ]
+        processes = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            process = multiprocessing.Process(
+                target=self.render_segment, args=(start, stop, frames)
             )
-            print(" * Writing to {0:s}".format(filename))
-            self.visualizers[self.current_visualizer].s.write_to_png(filename)
-        print(" * Done")
+            process.start()
+            processes.append(process)
+        failed = 0
+        for process in processes:
+            process.join()
+            if process.exitcode:
+                failed += 1
+        if failed:
+            print(" * {0:d} render processes failed".format(failed))
+            return 1
+        return 0
+    
+    
+    def render_segment(self, start, stop, frames):
+        """Render process: render a segment with a surface, time manager,
+        onset detector and visualizers of its own, after warming up."""
+        self.surface = cairo.ImageSurface(
+            cairo.FORMAT_ARGB32, self.args.width, self.args.height
+        )
+        self.time = timemanager.TimeManager(live=False, fps=self.args.fps)
+        self.beats = beatdetect.OnsetDetector(self.args.fps)
+        self.create_visualizers()
+        sink = self.open_sink(frames, create=False)
+        self.render_frames(
+            sink, start, stop, int(self.args.warmup*self.args.fps)
+        )
+        sink.close()
         return 0
     
     
@@ -3,27 +3,40 @@ Visualizer Base Class
 """
 
 import cairo
+import timemanager
+import raster
 
 class Visualizer:
     
+    # objects that are handed to the visualizer instead of belonging to it
+    shared_attributes = (
+        'analyzer', 'surface', 'context', 'time', 'beats',
+        'a', 's', 'c', 't', 'b'
+    )
+    
     analyzer = None
     surface = None
     context = None
     time = None
+    beats = None
     properties = {}
+    static_layers = {}
     
     
-    def __init__(self, analyzer, surface, time):
+    def __init__(self, analyzer, surface, time, beats=None):
         self.analyzer = analyzer
         self.surface = surface
         self.context = cairo.Context(self.surface)
         self.time = time
+        self.beats = beats # beatdetect.OnsetDetector or None
         self.properties = {}
+        self.static_layers = {}
         # Convenience variables
         self.a = self.analyzer
         self.s = self.surface
         self.c = self.context
         self.t = self.time
+        self.b = self.beats
         self.p = self.properties
         self.w = self.surface.get_width()
         self.h = self.surface.get_height()
@@ -47,6 +60,90 @@ class Visualizer:
     def update_property(self, property_i, change):
         """
         Subclasses can use this function to trigger code when a property is 
-        changed.
+        changed. It marks the static layers that depend on the property for
+        drawing again, so subclasses should call it when they overwrite it.
+        """
+        self.invalidate_static_layers(property_i)
+        return 0
+    
+    
+    def add_static_layer(self, name, draw, properties=()):
+        """
+        Add a layer that doesn't change from frame to frame (a background, a
+        vignette, a scale, ...). It is drawn once on a surface of its own and
+        `paint_static_layer()` only paints that surface. It is drawn again
+        when one of the properties it depends on is changed with
+        `update_property()` or when the size of the surface changes.
+        
+        Arguments:
+        name        Name of the layer
+        draw        Function that draws the layer; called with a
+                    `cairo.Context` of a transparent surface, its width and
+                    its height
+        properties  Keys of `self.properties` the layer depends on
+        """
+        self.static_layers[name] = {
+            'draw' : draw,
+            'properties' : tuple(properties),
+            'surface' : None,
+        }
+        return 0
+    
+    
+    def paint_static_layer(self, name):
+        """
+        Paint a static layer onto the surface, drawing it first if needed.
+        """
+        layer = self.static_layers[name]
+        width = self.surface.get_width()
+        height = self.surface.get_height()
+        surface = layer['surface']
+        if surface is None or surface.get_width() != width \
+                or surface.get_height() != height:
+            surface = layer['surface'] = cairo.ImageSurface(
+                cairo.FORMAT_ARGB32, width, height
+            )
+            layer['draw'](cairo.Context(surface), width, height)
+            surface.flush()
+        self.context.set_source_surface(surface, 0, 0)
+        self.context.paint()
+        return 0
+    
+    
+    def invalidate_static_layers(self, property_i=None):
+        """
+        Draw the static layers that depend on a property (or all of them if
+        `property_i` is None) again the next time they are painted.
+        """
+        for layer in self.static_layers.values():
+            if property_i is None or property_i in layer['properties']:
+                layer['surface'] = None
+        return 0
+    
+    
+    def get_state(self):
+        """
+        Return what the visualizer keeps from frame to frame as a dictionary
+        that can be pickled, e.g. for a checkpoint. By default, these are all
+        attributes except the shared objects (`shared_attributes`), cairo
+        objects, rasters, static layers and time managers, which `setup()` or
+        `draw()` create again. Subclasses can extend this.
+        """
+        state = {}
+        for name, value in self.__dict__.items():
+            if name in self.shared_attributes or name == 'static_layers' \
+                    or isinstance(value, (
+                    cairo.Pattern, cairo.Surface, cairo.Context,
+                    raster.Raster, timemanager.TimeManager)):
+                continue
+            state[name] = value
+        return state
+    
+    
+    def set_state(self, state):
+        """
+        Restore a state returned by `get_state()`, after `setup()`.
         """
+        self.__dict__.update(state)
+        self.invalidate_static_layers() # the properties may have changed
         return 0
\ No newline at end of file